@@ -0,0 +1,546 @@
+from array import array
+from collections import Counter, deque
+from itertools import compress, repeat
+
+from lib.parser import (
+    ALLOWED_CHILDREN,
+    Audio,
+    BaseTag,
+    Break,
+    Media,
+    P,
+    Par,
+    Prosody,
+    S,
+    Seq,
+    Speak,
+    SSMLEncloseTag,
+    SSMLTree,
+    Text,
+    markup_token_regex,
+    resolve_allowed_children,
+)
+from lib.exceptions import InvalidSSMLSyntax
+from utils.helpers import get_attribute_dict, parse_duration_to_ms, paused_gc
+
+
+"""
+A flat, structure-of-arrays backend for SSML trees.
+
+Every node lives at an integer index. Tag codes, tree links and the parsed
+durations are kept in contiguous `array` columns, so aggregates such as the
+total break time run as column scans instead of walking node objects.
+`ArenaNode` is a lightweight view over one index and mirrors the object API.
+"""
+
+NO_NODE = -1
+
+TAG_CLASSES = [Text, Break, Speak, Audio, Media, Seq, Par, Prosody, S, P]
+TAG_CODES = {cls: code for code, cls in enumerate(TAG_CLASSES)}
+TAG_NAMES = {cls.__name__.lower(): code for cls, code in TAG_CODES.items()}
+
+# attribute holding the duration of a node, parsed into the duration column
+DURATION_ATTRIBUTES = {Break: "time", Prosody: "duration"}
+
+
+def _constructor_attributes(cls):
+    code = cls.__init__.__code__
+    return list(code.co_varnames[1 : code.co_argcount + code.co_kwonlyargcount])
+
+
+TAG_ATTRIBUTES = {
+    cls: _constructor_attributes(cls) for cls in TAG_CLASSES if cls is not Text
+}
+ENCLOSE_CLASSES = frozenset(
+    cls for cls in TAG_CLASSES if issubclass(cls, SSMLEncloseTag)
+)
+TAG_ATTRIBUTE_SETS = {cls: frozenset(attrs) for cls, attrs in TAG_ATTRIBUTES.items()}
+
+# instance __dict__ of a fresh node of every class, used by `materialize`
+NODE_TEMPLATES = {
+    cls: vars(Text("") if cls is Text else cls()) for cls in TAG_CLASSES
+}
+
+
+class ArenaNode(object):
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree, index) -> None:
+        object.__setattr__(self, "tree", tree)
+        object.__setattr__(self, "index", index)
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, ArenaNode)
+            and other.tree is self.tree
+            and other.index == self.index
+        )
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.index))
+
+    def __repr__(self) -> str:
+        return f"<ArenaNode {self.tag} #{self.index}>"
+
+    def __str__(self) -> str:
+        return str(self.tree.materialize(self.index))
+
+    def __getattr__(self, name):
+        tree, index = self.tree, self.index
+        tag_class = TAG_CLASSES[tree.tags[index]]
+        if tag_class is Text:
+            if name == "text":
+                return tree.texts[index]
+            if name == "id":
+                return None
+        else:
+            attrs = tree.attribs.get(index, {})
+            if name in attrs:
+                return attrs[name]
+            if name in TAG_ATTRIBUTE_SETS[tag_class]:
+                return None
+        raise AttributeError(f"{tag_class.__name__} node has no attribute {name!r}")
+
+    def __setattr__(self, name, value) -> None:
+        tree, index = self.tree, self.index
+        tag_class = TAG_CLASSES[tree.tags[index]]
+        if tag_class is Text:
+            if name == "text":
+                return tree.set_text(index, value)
+        elif name in TAG_ATTRIBUTE_SETS[tag_class] or name in tree.attribs.get(index, {}):
+            return tree.set_attribute(index, name, value)
+        raise AttributeError(f"{tag_class.__name__} node has no attribute {name!r}")
+
+    @property
+    def tag(self) -> str:
+        return TAG_CLASSES[self.tree.tags[self.index]].__name__.lower()
+
+    @property
+    def tag_class(self):
+        return TAG_CLASSES[self.tree.tags[self.index]]
+
+    @property
+    def parent_node(self):
+        return self.tree.view(self.tree.parent[self.index])
+
+    @property
+    def prev_node(self):
+        return self.tree.view(self.tree.prev_sibling[self.index])
+
+    @property
+    def next_node(self):
+        return self.tree.view(self.tree.next_sibling[self.index])
+
+    @property
+    def child_ptr(self):
+        return self.tree.view(self.tree.first_child[self.index])
+
+    def is_root(self):
+        return self.tree.prev_sibling[self.index] == NO_NODE
+
+    def is_tail(self):
+        return self.tree.next_sibling[self.index] == NO_NODE
+
+    def get_children(self):
+        return [self.tree.view(i) for i in self.tree.children(self.index)]
+
+    def get_siblings(self):
+        parent = self.tree.parent[self.index]
+        if parent == NO_NODE:
+            return []
+        return [
+            self.tree.view(i) for i in self.tree.children(parent) if i != self.index
+        ]
+
+    def add_child(self, node, trusted=False):
+        return self.tree.append_child(self.index, node, trusted=trusted)
+
+    def find(self, tag):
+        return self.tree.find(tag, start=self.index)
+
+    def find_all(self, tag):
+        return self.tree.find_all(tag, start=self.index)
+
+    def find_by_id(self, id):
+        return self.tree.find_node_by_id(id, start=self.index)
+
+
+class ArenaTree:
+    """SSMLTree compatible tree whose nodes are stored column-wise."""
+
+    def __init__(self, id="root", lang="en") -> None:
+        self.tags = array("b")
+        self.parent = array("l")
+        self.first_child = array("l")
+        self.last_child = array("l")
+        self.prev_sibling = array("l")
+        self.next_sibling = array("l")
+        # -1 marks a node without a (parsable) duration
+        self.duration_ms = array("l")
+        # length of the text payload, 0 for tags
+        self.char_count = array("l")
+        # sparse per-node payloads
+        self.texts = {}
+        self.attribs = {}
+        # every child stored after its parent, see `subtree_char_counts`
+        self.ordered = True
+        self.__root = self.new_node(Speak, id=id, lang=lang)
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def __str__(self) -> str:
+        return str(self.materialize(self.__root))
+
+    @property
+    def root(self):
+        return self.view(self.__root)
+
+    def view(self, index):
+        if index == NO_NODE:
+            return None
+        return ArenaNode(self, index)
+
+    def new_node(self, tag_class, text=None, **attrs):
+        if tag_class not in TAG_CODES:
+            raise ValueError(f"{tag_class} can't be stored in an arena")
+        index = len(self.tags)
+        self.tags.append(TAG_CODES[tag_class])
+        self.parent.append(NO_NODE)
+        self.first_child.append(NO_NODE)
+        self.last_child.append(NO_NODE)
+        self.prev_sibling.append(NO_NODE)
+        self.next_sibling.append(NO_NODE)
+        self.duration_ms.append(NO_NODE)
+        if tag_class is Text:
+            if type(text) != str:
+                raise TypeError("Invalid type, text only recieves object of type str")
+            self.texts[index] = text
+            self.char_count.append(len(text))
+        else:
+            self.char_count.append(0)
+            attrs = {key: val for key, val in attrs.items() if val is not None}
+            if attrs:
+                self.attribs[index] = attrs
+                self._update_duration(index)
+        return index
+
+    def set_text(self, index, text):
+        if type(text) != str:
+            raise TypeError("Invalid type, text only recieves object of type str")
+        self.texts[index] = text
+        self.char_count[index] = len(text)
+
+    def set_attribute(self, index, name, value):
+        self.attribs.setdefault(index, {})[name] = value
+        self._update_duration(index)
+
+    def _update_duration(self, index):
+        duration_attr = DURATION_ATTRIBUTES.get(TAG_CLASSES[self.tags[index]])
+        if duration_attr is None:
+            return
+        duration = parse_duration_to_ms(self.attribs.get(index, {}).get(duration_attr))
+        self.duration_ms[index] = NO_NODE if duration is None else duration
+
+    def children(self, index):
+        res = []
+        curr = self.first_child[index]
+        while curr != NO_NODE:
+            res.append(curr)
+            curr = self.next_sibling[curr]
+        return res
+
+    def link_child(self, parent, child):
+        tail = self.last_child[parent]
+        if tail == NO_NODE:
+            self.first_child[parent] = child
+        else:
+            self.next_sibling[tail] = child
+            self.prev_sibling[child] = tail
+        self.last_child[parent] = child
+        self.parent[child] = parent
+        if child < parent:
+            self.ordered = False
+
+    def append_child(self, parent, node, trusted=False):
+        parent_class = TAG_CLASSES[self.tags[parent]]
+        if not issubclass(parent_class, SSMLEncloseTag):
+            raise ValueError(f"{parent_class} can't have children")
+
+        if isinstance(node, ArenaNode):
+            if node.tree is not self:
+                node = node.tree.materialize(node.index)
+            elif node.index == parent:
+                raise ValueError("Can't add the object as it's child")
+            elif self.parent[node.index] != NO_NODE:
+                raise ValueError(f"{node} already has a parent")
+            else:
+                if not trusted:
+                    self._check_child(parent_class, node.tag_class, node)
+                self.link_child(parent, node.index)
+                return node
+
+        if not isinstance(node, BaseTag):
+            raise ValueError(f"{node.__repr__()} is not a valid child for {parent_class}")
+        if not trusted:
+            self._check_child(parent_class, type(node), node)
+        return self.view(self.import_node(node, parent))
+
+    @staticmethod
+    def _check_child(parent_class, child_class, node):
+        try:
+            allowed = ALLOWED_CHILDREN[parent_class]
+        except KeyError:
+            allowed = resolve_allowed_children(parent_class)
+        if allowed is not None and child_class not in allowed:
+            raise ValueError(f"{node.__repr__()} is not a valid child for {parent_class}")
+
+    def import_node(self, node, parent=NO_NODE):
+        """Copies an object tree into the arena and returns the new index."""
+        head = None
+        stack = [(node, parent)]
+        while len(stack) != 0:
+            curr_node, curr_parent = stack.pop()
+            if isinstance(curr_node, Text):
+                index = self.new_node(Text, text=str(curr_node))
+            else:
+                attrs = {
+                    name: getattr(curr_node, name, None)
+                    for name in TAG_ATTRIBUTES[type(curr_node)]
+                }
+                attrs.update(curr_node.attrib)
+                index = self.new_node(type(curr_node), **attrs)
+            if curr_parent != NO_NODE:
+                self.link_child(curr_parent, index)
+            if head is None:
+                head = index
+            if isinstance(curr_node, SSMLEncloseTag):
+                stack.extend(
+                    (child, index) for child in reversed(curr_node.get_children())
+                )
+        return head
+
+    def materialize(self, index):
+        """Builds the object tree rooted at `index`.
+
+        Nodes are created from per class templates and linked straight from
+        the columns, which is much cheaper than constructing them and adding
+        them one by one.
+        """
+        tags, texts, attribs = self.tags, self.texts, self.attribs
+        first_child, next_sibling = self.first_child, self.next_sibling
+        # the extra slot makes objs[NO_NODE] None
+        objs = [None] * (len(tags) + 1)
+        order = []
+        new = object.__new__
+
+        with paused_gc():
+            stack = [index]
+            while len(stack) != 0:
+                curr = stack.pop()
+                order.append(curr)
+                tag_class = TAG_CLASSES[tags[curr]]
+                node_dict = dict(NODE_TEMPLATES[tag_class])
+                node_dict["attrib"] = {}
+                if tag_class is Text:
+                    node_dict["_Text__text"] = texts[curr]
+                else:
+                    attrs = attribs.get(curr)
+                    if attrs:
+                        known = TAG_ATTRIBUTE_SETS[tag_class]
+                        for name, value in attrs.items():
+                            if name in known:
+                                node_dict[name] = value
+                            else:
+                                node_dict["attrib"][name] = value
+                node = new(tag_class)
+                node.__dict__ = node_dict
+                objs[curr] = node
+                child = first_child[curr]
+                while child != NO_NODE:
+                    stack.append(child)
+                    child = next_sibling[child]
+
+            parent, prev_sibling = self.parent, self.prev_sibling
+            last_child = self.last_child
+            for curr in order:
+                node_dict = objs[curr].__dict__
+                node_dict["parent_node"] = objs[parent[curr]]
+                node_dict["prev_node"] = objs[prev_sibling[curr]]
+                node_dict["next_node"] = objs[next_sibling[curr]]
+                if "child_ptr" in node_dict:
+                    node_dict["child_ptr"] = objs[first_child[curr]]
+                    node_dict["_last_child"] = objs[last_child[curr]]
+
+        res = objs[index]
+        res.parent_node = res.prev_node = res.next_node = None
+        return res
+
+    def parse_fragment(self, ssml_text: str, parent=None):
+        """Parses a run of SSML nodes straight into the arena.
+
+        The nodes are appended to `parent` (the root by default); text and
+        tags are handled like `SSMLTree.parse`.
+        """
+        opened_tags = [self.__root if parent is None else parent]
+        last_index = 0
+        new_node, link_child = self.new_node, self.link_child
+
+        for token in markup_token_regex.finditer(ssml_text):
+            text = ssml_text[last_index : token.start()]
+            last_index = token.end()
+            if text.strip() != "":
+                link_child(opened_tags[-1], new_node(Text, text=text.strip("\n")))
+
+            is_close, tagname, tagattrib, is_inline = token.groups()
+            if is_close:
+                if len(opened_tags) == 1:
+                    raise InvalidSSMLSyntax(f"The tag {tagname} was never opened.")
+                last_tagname = TAG_CLASSES[self.tags[opened_tags[-1]]].__name__.lower()
+                if tagname != last_tagname:
+                    raise InvalidSSMLSyntax(
+                        f"The last opened tag <{last_tagname}> was not closed!"
+                    )
+                opened_tags.pop()
+                continue
+
+            try:
+                tag_class = SSMLTree.token_types[tagname]
+            except KeyError:
+                raise InvalidSSMLSyntax(f"{tagname} is a Invalid tag.")
+            if tagattrib:
+                index = new_node(tag_class, **get_attribute_dict(tagattrib))
+            else:
+                index = new_node(tag_class)
+            link_child(opened_tags[-1], index)
+            if tag_class in ENCLOSE_CLASSES and not is_inline:
+                opened_tags.append(index)
+
+        text = ssml_text[last_index:]
+        if text.strip() != "":
+            self.link_child(opened_tags[-1], self.new_node(Text, text=text.strip("\n")))
+        if len(opened_tags) != 1:
+            last_tagname = TAG_CLASSES[self.tags[opened_tags[-1]]].__name__.lower()
+            raise InvalidSSMLSyntax(f"The tag {last_tagname} wasn't closed.")
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Creates an arena from an `SSMLTree` or any enclosing node."""
+        root = tree.root if isinstance(tree, SSMLTree) else tree
+        arena = cls(id=root.id, lang=getattr(root, "lang", None))
+        arena_root = arena.root
+        for child in root.get_children():
+            arena_root.add_child(child)
+        return arena
+
+    def to_tree(self):
+        tree = SSMLTree()
+        root = self.materialize(self.__root)
+        tree.root.id = root.id
+        tree.root.lang = root.lang
+        for child in root.get_children():
+            child.prev_node = child.next_node = child.parent_node = None
+            tree.add_child(child)
+        return tree
+
+    def add_child(self, node, trusted=False):
+        return self.append_child(self.__root, node, trusted=trusted)
+
+    def _bfs(self, start):
+        traverse_queue = deque(self.children(start))
+        while len(traverse_queue) != 0:
+            index = traverse_queue.popleft()
+            yield index
+            traverse_queue.extend(self.children(index))
+
+    def find(self, tag, start=None):
+        code = TAG_NAMES.get(tag)
+        if code is None:
+            return None
+        for index in self._bfs(self.__root if start is None else start):
+            if self.tags[index] == code:
+                return self.view(index)
+        return None
+
+    def find_all(self, tag, start=None):
+        code = TAG_NAMES.get(tag)
+        if code is None:
+            return []
+        return [
+            self.view(index)
+            for index in self._bfs(self.__root if start is None else start)
+            if self.tags[index] == code
+        ]
+
+    def find_node_by_id(self, id, start=None):
+        for index in self._bfs(self.__root if start is None else start):
+            if self.attribs.get(index, {}).get("id") == id:
+                return self.view(index)
+        return None
+
+    def to_markup_string(self):
+        return str(self)
+
+    def write_to_file(self, filename):
+        with open(f"{filename}.xml", "w") as f:
+            f.write(str(self))
+
+    # column queries
+
+    def mask(self, tag):
+        """Per node flags of the `tag` nodes; unknown tags match nothing,
+        like `find` and `find_all`."""
+        code = TAG_NAMES.get(tag)
+        if code is None:
+            return repeat(False, len(self.tags))
+        return map(code.__eq__, self.tags)
+
+    def select(self, tag):
+        """Indices of every `tag` node in insertion order."""
+        return array("l", compress(range(len(self.tags)), self.mask(tag)))
+
+    def count(self, tag):
+        return sum(self.mask(tag))
+
+    def durations(self, tag):
+        """Parsed durations (ms) of the `tag` nodes that declare one."""
+        return array(
+            "l", filter(NO_NODE.__lt__, compress(self.duration_ms, self.mask(tag)))
+        )
+
+    def total_duration(self, tag="break"):
+        return sum(self.durations(tag))
+
+    def duration_histogram(self, tag="prosody", bin_ms=100):
+        return dict(
+            sorted(Counter(d - d % bin_ms for d in self.durations(tag)).items())
+        )
+
+    def subtree_char_counts(self):
+        """Number of text characters below every node.
+
+        Parsed and imported nodes are stored after their parent, so a
+        reverse scan of the `parent` column adds every subtree up before
+        its parent is reached. Linking an older node under a newer one
+        breaks that order, the tree is then walked once to get it back.
+        """
+        if self.ordered:
+            order = range(len(self.tags) - 1, -1, -1)
+        else:
+            order = []
+            stack = [self.__root]
+            while len(stack) != 0:
+                index = stack.pop()
+                order.append(index)
+                stack.extend(self.children(index))
+            order.reverse()
+        totals = array("l", self.char_count)
+        parent = self.parent
+        for index in order:
+            if parent[index] != NO_NODE:
+                totals[parent[index]] += totals[index]
+        return totals
+
+    def char_counts(self, tag="s"):
+        """Text characters per `tag` node, aligned with `select(tag)`."""
+        return array("l", compress(self.subtree_char_counts(), self.mask(tag)))
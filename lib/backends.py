@@ -0,0 +1,346 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import hashlib
+import importlib
+import io
+import re
+import threading
+import time
+
+from utils.helpers import format_ms_to_vtt_timestamp
+
+
+"""
+Interfaces to the third party services used by the pipeline.
+
+The concrete backends import their client libraries on first use, so
+importing this module (or the parser/transpiler) stays standard library only.
+"""
+
+
+def lazy_import(name):
+    return importlib.import_module(name)
+
+
+class SpeechBackend(ABC):
+    # largest SSML document accepted in one request, in UTF-8 bytes
+    max_request_bytes = None
+
+    @abstractmethod
+    def synthesize(self, ssml: str, lang: str, voice=None) -> bytes:
+        pass
+
+
+class VideoBackend(ABC):
+    @abstractmethod
+    def extract_info(self, url: str, options=None) -> dict:
+        pass
+
+    @abstractmethod
+    def fetch_text(self, url: str) -> str:
+        pass
+
+    @abstractmethod
+    def download(self, url: str, filename: str) -> str:
+        pass
+
+
+class CaptionReader(ABC):
+    @abstractmethod
+    def read(self, filename: str):
+        """Returns the captions of a file, each with text, lines, start and end."""
+
+    @abstractmethod
+    def read_text(self, text: str):
+        pass
+
+
+class Translator(ABC):
+    @abstractmethod
+    def translate_batch(self, texts, target: str, source=None):
+        """Returns the translations of `texts`, in the same order."""
+
+
+class ClientPool(object):
+    """Keeps up to `size` warm clients around for reuse across jobs."""
+
+    def __init__(self, factory, size=4) -> None:
+        self.factory = factory
+        self.size = size
+        self._idle = []
+        self._created = 0
+        self._available = threading.Condition()
+
+    @contextmanager
+    def acquire(self):
+        with self._available:
+            while not self._idle and self._created >= self.size:
+                self._available.wait()
+            client = self._idle.pop() if self._idle else None
+            if client is None:
+                self._created += 1
+        if client is None:
+            try:
+                client = self.factory()
+            except BaseException:
+                # give the slot back, a waiting caller may create the client
+                with self._available:
+                    self._created -= 1
+                    self._available.notify()
+                raise
+        try:
+            yield client
+        finally:
+            with self._available:
+                self._idle.append(client)
+                self._available.notify()
+
+
+class GoogleSpeechBackend(SpeechBackend):
+    max_request_bytes = 5000
+
+    def __init__(self, ssml_gender="MALE", audio_encoding="MP3") -> None:
+        self.ssml_gender = ssml_gender
+        self.audio_encoding = audio_encoding
+        self._client = None
+
+    @property
+    def texttospeech(self):
+        return lazy_import("google.cloud.texttospeech")
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self.texttospeech.TextToSpeechClient()
+        return self._client
+
+    def synthesize(self, ssml: str, lang: str, voice=None) -> bytes:
+        texttospeech = self.texttospeech
+        synthesis_input = texttospeech.SynthesisInput(ssml=ssml)
+        voice_options = {
+            "language_code": lang,
+            "ssml_gender": getattr(texttospeech.SsmlVoiceGender, self.ssml_gender),
+        }
+        if voice:
+            voice_options["name"] = voice
+        voice_params = texttospeech.VoiceSelectionParams(**voice_options)
+        audio_config = texttospeech.AudioConfig(
+            audio_encoding=getattr(texttospeech.AudioEncoding, self.audio_encoding)
+        )
+        response = self.client.synthesize_speech(
+            input=synthesis_input, voice=voice_params, audio_config=audio_config
+        )
+        return response.audio_content
+
+
+class YtDlpVideoBackend(VideoBackend):
+    def __init__(self, pool_size=4) -> None:
+        self.pool_size = pool_size
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, options):
+        key = repr(sorted((options or {}).items()))
+        with self._lock:
+            if key not in self._pools:
+                yt_dlp = lazy_import("yt_dlp")
+                self._pools[key] = ClientPool(
+                    lambda: yt_dlp.YoutubeDL(options), self.pool_size
+                )
+            return self._pools[key]
+
+    def extract_info(self, url: str, options=None) -> dict:
+        with self._pool(options).acquire() as ydl:
+            return ydl.extract_info(url, download=False)
+
+    def fetch_text(self, url: str) -> str:
+        requests = lazy_import("requests")
+        return requests.get(url).text
+
+    def download(self, url: str, filename: str) -> str:
+        urllib_request = lazy_import("urllib.request")
+        urllib_request.urlretrieve(url, filename)
+        return filename
+
+
+class WebVTTCaptionReader(CaptionReader):
+    def read(self, filename: str):
+        webvtt = lazy_import("webvtt")
+        return webvtt.read(filename)
+
+    def read_text(self, text: str):
+        webvtt = lazy_import("webvtt")
+        return webvtt.read_buffer(io.StringIO(text))
+
+
+class Caption(object):
+    def __init__(self, start, end, lines) -> None:
+        self.start = start
+        self.end = end
+        self.lines = lines
+
+    @property
+    def text(self):
+        return "\n".join(cue_tag_regex.sub("", line) for line in self.lines)
+
+
+cue_tag_regex = re.compile(r"<[^>]*>")
+
+
+class BasicVTTCaptionReader(CaptionReader):
+    """Standard library WebVTT reader, enough for the cues YouTube serves."""
+
+    @staticmethod
+    def format_timestamp(timestamp):
+        if timestamp.count(":") == 1:
+            timestamp = "00:" + timestamp
+        return timestamp
+
+    def read(self, filename: str):
+        with open(filename) as f:
+            return self.read_text(f.read())
+
+    def read_text(self, text: str):
+        captions = []
+        for block in re.split(r"\n{2,}", text.replace("\r\n", "\n")):
+            lines = block.strip("\n").split("\n")
+            for i, line in enumerate(lines):
+                if "-->" in line:
+                    start, end = line.split("-->")
+                    captions.append(
+                        Caption(
+                            self.format_timestamp(start.strip()),
+                            self.format_timestamp(end.strip().split(" ")[0]),
+                            lines[i + 1 :],
+                        )
+                    )
+                    break
+        return captions
+
+
+class FakeSpeechBackend(SpeechBackend):
+    """Offline speech backend, returns a digest of the request as audio."""
+
+    def __init__(self, latency=0.0) -> None:
+        self.latency = latency
+        self.requests = 0
+
+    def synthesize(self, ssml: str, lang: str, voice=None) -> bytes:
+        if self.latency:
+            time.sleep(self.latency)
+        self.requests += 1
+        return hashlib.sha256(f"{lang}|{voice}|{ssml}".encode()).digest()
+
+
+class FakeVideoBackend(VideoBackend):
+    """Offline video backend serving generated WebVTT captions."""
+
+    def __init__(self, latency=0.0, cues=20, manual_langs=()) -> None:
+        self.latency = latency
+        self.cues = cues
+        self.manual_langs = manual_langs
+
+    def extract_info(self, url: str, options=None) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        video_id = hashlib.md5(url.encode()).hexdigest()[:11]
+        return {
+            "id": video_id,
+            "title": f"fake-{video_id}",
+            "url": f"fake://{video_id}/audio",
+            "automatic_captions": {
+                lang: [{"ext": "vtt", "url": f"fake://{video_id}/{lang}.vtt"}]
+                for lang in ("en", "fr", "ar")
+            },
+            "subtitles": {
+                lang: [{"ext": "vtt", "url": f"fake://{video_id}/{lang}.manual.vtt"}]
+                for lang in self.manual_langs
+            },
+        }
+
+    def fetch_text(self, url: str) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        cues = ["WEBVTT", ""]
+        for i in range(self.cues):
+            start = format_ms_to_vtt_timestamp(i * 1000)
+            end = format_ms_to_vtt_timestamp(i * 1000 + 900)
+            cues.append(f"{start} --> {end}")
+            cues.append(f"caption number {i} of {url}")
+            cues.append("")
+        return "\n".join(cues)
+
+    def download(self, url: str, filename: str) -> str:
+        with open(filename, "wb") as f:
+            f.write(url.encode())
+        return filename
+
+
+class GoogleTranslator(Translator):
+    def __init__(self) -> None:
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = lazy_import("google.cloud.translate_v2").Client()
+        return self._client
+
+    def translate_batch(self, texts, target: str, source=None):
+        results = self.client.translate(
+            list(texts), target_language=target, source_language=source, format_="text"
+        )
+        return [result["translatedText"] for result in results]
+
+
+class StubTranslator(Translator):
+    """Offline translator, tags every text with the target language."""
+
+    def __init__(self, latency=0.0) -> None:
+        self.latency = latency
+        self.batches = 0
+        self.characters = 0
+        self._lock = threading.Lock()
+
+    def translate_batch(self, texts, target: str, source=None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.batches += 1
+            self.characters += sum(len(text) for text in texts)
+        return [f"[{target}] {text}" for text in texts]
+
+
+SPEECH_BACKENDS = {"google": GoogleSpeechBackend, "fake": FakeSpeechBackend}
+VIDEO_BACKENDS = {"yt_dlp": YtDlpVideoBackend, "fake": FakeVideoBackend}
+CAPTION_READERS = {"webvtt": WebVTTCaptionReader, "basic": BasicVTTCaptionReader}
+TRANSLATORS = {"google": GoogleTranslator, "stub": StubTranslator}
+
+_default_backends = {}
+
+
+def _get_backend(registry, name):
+    try:
+        backend_class = registry[name]
+    except KeyError:
+        raise ValueError(f"Unknown backend {name}, expected one of {list(registry)}")
+    key = (id(registry), name)
+    if key not in _default_backends:
+        _default_backends[key] = backend_class()
+    return _default_backends[key]
+
+
+def get_speech_backend(name="google") -> SpeechBackend:
+    return _get_backend(SPEECH_BACKENDS, name)
+
+
+def get_video_backend(name="yt_dlp") -> VideoBackend:
+    return _get_backend(VIDEO_BACKENDS, name)
+
+
+def get_caption_reader(name="webvtt") -> CaptionReader:
+    return _get_backend(CAPTION_READERS, name)
+
+
+def get_translator(name="google") -> Translator:
+    return _get_backend(TRANSLATORS, name)
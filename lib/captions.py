@@ -0,0 +1,292 @@
+"""Collapses rolling auto-captions into sentence level SSML.
+
+YouTube auto-captions repeat every line across consecutive cues (the
+previous line stays on screen while the next one rolls in), so the cue
+text can't be synthesized as it is. Each cue is tokenized into words and
+the longest suffix of the already emitted words that is a prefix of the
+cue is found with a KMP failure function, only the remaining words are
+new. An overlap only counts when it covers whole cue lines or at least
+`min_overlap_words` words, so speech that merely starts with the word the
+previous cue ended with is kept. The words are then grouped into
+sentences, on punctuation or pauses, and every sentence becomes a `S`
+node timed from its words.
+
+Only automatic captions roll, manually written subtitles are transpiled
+as they are.
+
+    python -m lib.captions captions.vtt [--reader basic]
+
+prints how many characters the collapse saves against the cue text and
+the legacy transpiler, for the text and for the whole SSML document (what
+text to speech bills).
+"""
+import argparse
+import re
+import sys
+
+from lib.parser import Break, Prosody, S, SSMLTree, Text
+from utils.helpers import format_vtt_timestamp_to_ms
+
+
+DEFAULT_PAUSE_MS = 1200
+DEFAULT_MAX_SENTENCE_WORDS = 40
+# shortest partial overlap treated as a repeat, whole lines always are
+MIN_OVERLAP_WORDS = 3
+# longest overlap looked for, rolling cues are a couple of lines long
+MAX_OVERLAP_WORDS = 256
+
+inline_timestamp_regex = re.compile(r"<(\d+:\d\d:\d\d\.\d{3})>")
+cue_tag_regex = re.compile(r"<[^>]*>")
+normalize_regex = re.compile(r"[^\w']+")
+sentence_end_regex = re.compile(r"[.?!]['\"]?$")
+
+
+class CaptionWord(object):
+    __slots__ = ("text", "token", "start", "end")
+
+    def __init__(self, text, token, start, end) -> None:
+        self.text = text
+        self.token = token
+        self.start = start
+        self.end = end
+
+
+class CollapseStats(object):
+    def __init__(self) -> None:
+        self.cues = 0
+        self.cue_characters = 0
+        self.cue_words = 0
+        self.emitted_words = 0
+        self.sentences = 0
+        self.characters = 0
+
+    @property
+    def saved_characters(self):
+        return self.cue_characters - self.characters
+
+    def __str__(self) -> str:
+        return (
+            f"{self.cues} cues, {self.cue_words} words -> {self.emitted_words} words "
+            f"in {self.sentences} sentences, {self.cue_characters} -> "
+            f"{self.characters} characters"
+        )
+
+
+def failure_function(tokens):
+    """KMP failure function: the length of the longest proper prefix of
+    `tokens[: i + 1]` that is also its suffix, for every i."""
+    failure = [0] * len(tokens)
+    k = 0
+    for i in range(1, len(tokens)):
+        while k and tokens[i] != tokens[k]:
+            k = failure[k - 1]
+        if tokens[i] == tokens[k]:
+            k += 1
+        failure[i] = k
+    return failure
+
+
+def suffix_prefix_overlap(history, tokens):
+    """Length of the longest suffix of `history` that is a prefix of `tokens`.
+
+    Runs in O(len(history) + len(tokens)); only the last len(tokens) items of
+    history can take part in an overlap, so callers pass that window.
+    """
+    if not tokens:
+        return 0
+    failure = failure_function(tokens)
+    k = 0
+    for token in history:
+        while k and (k == len(tokens) or token != tokens[k]):
+            k = failure[k - 1]
+        if token == tokens[k]:
+            k += 1
+    return k
+
+
+def is_sound_tag(text):
+    return text.startswith("[") and text.endswith("]")
+
+
+def cue_words(caption):
+    """Words of a cue with their start and end times, and the number of
+    words at the end of each line.
+
+    Inline timestamps give the start of the word after them, text before
+    the first one starts with the cue. Words without a time of their own
+    (manual captions, the repeated line of rolling auto-captions) are
+    spread up to the next known time in proportion to their length.
+    """
+    start_ms = format_vtt_timestamp_to_ms(caption.start)
+    end_ms = format_vtt_timestamp_to_ms(caption.end)
+    words = []
+    line_ends = set()
+    for line in caption.lines:
+        segments = inline_timestamp_regex.split(line)
+        segment_start = start_ms if len(segments) > 1 else None
+        for i, segment in enumerate(segments):
+            if i % 2 == 1:
+                segment_start = format_vtt_timestamp_to_ms(segment)
+                continue
+            for text in cue_tag_regex.sub("", segment).split():
+                token = normalize_regex.sub("", text.lower())
+                if token == "" or is_sound_tag(text):
+                    continue
+                words.append(CaptionWord(text, token, segment_start, end_ms))
+                segment_start = None
+        line_ends.add(len(words))
+    spread_word_times(words, start_ms, end_ms)
+    return words, line_ends
+
+
+def spread_word_times(words, start_ms, end_ms):
+    """Fills in missing word starts and sets every end to the next later
+    start, the last words end with the cue."""
+    if words and words[0].start is None:
+        words[0].start = start_ms
+    i = 0
+    while i < len(words):
+        j = i + 1
+        while j < len(words) and words[j].start is None:
+            j += 1
+        run_end = words[j].start if j < len(words) else end_ms
+        weights = [len(word.text) + 1 for word in words[i:j]]
+        total = sum(weights)
+        elapsed = 0
+        span = max(run_end - words[i].start, 0)
+        for word, weight in zip(words[i + 1 : j], weights):
+            elapsed += weight
+            word.start = words[i].start + span * elapsed // total
+        i = j
+    for prev_word, word in zip(words, words[1:]):
+        word.start = max(word.start, prev_word.start)
+
+    bound = end_ms
+    following_start = None
+    for word in reversed(words):
+        if following_start is not None and following_start > word.start:
+            bound = following_start
+        word.end = max(bound, word.start)
+        following_start = word.start
+
+
+def collapse_captions(captions, stats=None, min_overlap_words=MIN_OVERLAP_WORDS):
+    """Returns the words of rolling `captions` with the repeats removed."""
+    emitted = []
+    tokens_window = []
+    for caption in captions:
+        words, line_ends = cue_words(caption)
+        if stats is not None:
+            stats.cues += 1
+            stats.cue_characters += len(caption.text.strip())
+            stats.cue_words += len(words)
+        if not words:
+            continue
+        tokens = [word.token for word in words][:MAX_OVERLAP_WORDS]
+        overlap = suffix_prefix_overlap(tokens_window[-len(tokens):], tokens)
+        if overlap < min_overlap_words and overlap not in line_ends:
+            overlap = 0
+        for word in words[overlap:]:
+            if emitted and emitted[-1].start < word.start < emitted[-1].end:
+                emitted[-1].end = word.start
+            emitted.append(word)
+            tokens_window.append(word.token)
+        if len(tokens_window) > 4 * MAX_OVERLAP_WORDS:
+            del tokens_window[:-MAX_OVERLAP_WORDS]
+    if stats is not None:
+        stats.emitted_words = len(emitted)
+    return emitted
+
+
+def group_sentences(
+    words, pause_ms=DEFAULT_PAUSE_MS, max_words=DEFAULT_MAX_SENTENCE_WORDS
+):
+    sentences = []
+    sentence = []
+    for word in words:
+        if sentence and (
+            word.start - sentence[-1].end > pause_ms or len(sentence) >= max_words
+        ):
+            sentences.append(sentence)
+            sentence = []
+        sentence.append(word)
+        if sentence_end_regex.search(word.text):
+            sentences.append(sentence)
+            sentence = []
+    if sentence:
+        sentences.append(sentence)
+    return sentences
+
+
+def collapse_captions_to_ssml(
+    captions,
+    pause_ms=DEFAULT_PAUSE_MS,
+    max_words=DEFAULT_MAX_SENTENCE_WORDS,
+    stats=None,
+    min_overlap_words=MIN_OVERLAP_WORDS,
+):
+    ssml_tree = SSMLTree()
+    root = ssml_tree.root
+    last_end = 0
+    words = collapse_captions(captions, stats, min_overlap_words)
+    for sentence in group_sentences(words, pause_ms, max_words):
+        start_ms = sentence[0].start
+        end_ms = max(sentence[-1].end, start_ms)
+        if start_ms > last_end:
+            root.add_child(Break(time=f"{start_ms - last_end}ms"), trusted=True)
+        text = " ".join(word.text for word in sentence)
+        node = S()
+        if end_ms > start_ms:
+            node.add_child(
+                Prosody(duration=f"{end_ms - start_ms}ms"), trusted=True
+            ).add_child(Text(text), trusted=True)
+        else:
+            node.add_child(Text(text), trusted=True)
+        root.add_child(node, trusted=True)
+        last_end = max(last_end, end_ms)
+        if stats is not None:
+            stats.sentences += 1
+            stats.characters += len(text)
+    return ssml_tree
+
+
+def text_characters(tree):
+    return sum(len(str(node)) for node in tree.find_all("text"))
+
+
+def main(argv=None):
+    from lib.backends import get_caption_reader
+    from lib.transpiler import convert_captions_to_ssml
+
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("files", nargs="+", help="WebVTT files")
+    arg_parser.add_argument("--reader", default="basic", help="caption reader backend")
+    arg_parser.add_argument("--pause-ms", type=int, default=DEFAULT_PAUSE_MS)
+    args = arg_parser.parse_args(argv)
+
+    reader = get_caption_reader(args.reader)
+    for filename in args.files:
+        captions = reader.read(filename)
+        stats = CollapseStats()
+        collapsed = collapse_captions_to_ssml(captions, args.pause_ms, stats=stats)
+        legacy = convert_captions_to_ssml(captions)
+        print(f"{filename}: {stats}")
+        print(
+            f"    text: cue text {stats.cue_characters}, legacy transpiler "
+            f"{text_characters(legacy)}, collapsed {text_characters(collapsed)} characters"
+        )
+        legacy_characters = len(str(legacy))
+        print(
+            f"    SSML: legacy transpiler {legacy_characters}, "
+            f"collapsed {len(str(collapsed))} characters"
+        )
+        if legacy_characters:
+            print(
+                f"    {1 - len(str(collapsed)) / legacy_characters:.1%} "
+                "fewer SSML characters than the legacy transpiler"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
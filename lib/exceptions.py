@@ -3,3 +3,19 @@ class Error(Exception):
 
 class InvalidSSMLSyntax(Error):
     pass
+
+class InvalidSSMLStructure(Error):
+    def __init__(self, violations) -> None:
+        self.violations = violations
+        super().__init__(
+            f"{len(violations)} violation(s): " + "; ".join(str(v) for v in violations)
+        )
+
+class SubtitlesNotFound(Error):
+    pass
+
+class QueueFull(Error):
+    pass
+
+class LeaseLost(Error):
+    pass
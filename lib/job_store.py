@@ -0,0 +1,280 @@
+from contextlib import contextmanager
+import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+
+from lib.exceptions import LeaseLost
+
+
+"""
+A durable SQLite job store for batch workers.
+
+Every stage of a job saves its artifacts (info JSON, subtitles, the
+serialized SSMLTree, synthesized chunks) with their sha256 before the stage
+is marked complete, so a restarted worker resumes at the first incomplete
+stage. Jobs are claimed with a lease: a job whose worker stopped renewing
+its lease can be claimed again by another worker. `keep_lease` renews it
+from a background thread while a job runs, so slow stages (subtitle
+fetches, translation, rate limiter waits) don't lose it. A job whose lease
+expired `max_attempts` times (a worker crashing on it every time) is marked
+failed instead of being claimed again.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    lang TEXT NOT NULL,
+    voice TEXT,
+    tenant TEXT NOT NULL DEFAULT 'default',
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE TABLE IF NOT EXISTS stages (
+    job_id TEXT NOT NULL REFERENCES jobs (id),
+    stage TEXT NOT NULL,
+    completed REAL NOT NULL,
+    PRIMARY KEY (job_id, stage)
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    job_id TEXT NOT NULL REFERENCES jobs (id),
+    stage TEXT NOT NULL,
+    name TEXT NOT NULL,
+    content BLOB NOT NULL,
+    sha256 TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (job_id, stage, name)
+);
+"""
+
+
+class JobStore(object):
+    def __init__(
+        self, path, lease_seconds=300, timeout=30, max_attempts=3, clock=time.time
+    ) -> None:
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _transaction(self, statements):
+        """Runs `statements(cursor)` in one write transaction."""
+        with self._lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(cursor)
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+            return result
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def create_job(self, url, lang, voice=None, tenant="default"):
+        job_id = uuid.uuid4().hex
+        now = self.clock()
+        self._transaction(
+            lambda cursor: cursor.execute(
+                "INSERT INTO jobs (id, url, lang, voice, tenant, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, url, lang, voice, tenant, now, now),
+            )
+        )
+        return job_id
+
+    def get_job(self, job_id):
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return dict(rows[0]) if rows else None
+
+    def list_jobs(self, status=None):
+        if status is None:
+            rows = self._query("SELECT * FROM jobs ORDER BY created")
+        else:
+            rows = self._query(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created", (status,)
+            )
+        return [dict(row) for row in rows]
+
+    def claim(self, worker):
+        """Claims the oldest pending job, or one whose lease has expired.
+
+        Expired jobs already tried `max_attempts` times are failed instead.
+        """
+
+        def statements(cursor):
+            now = self.clock()
+            cursor.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, lease_expires = NULL, "
+                "updated = ? WHERE status = 'running' AND lease_expires < ? "
+                "AND attempts >= ?",
+                (
+                    f"lease expired after {self.max_attempts} attempts",
+                    now,
+                    now,
+                    self.max_attempts,
+                ),
+            )
+            row = cursor.execute(
+                "SELECT id FROM jobs WHERE status = 'pending' "
+                "OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY created LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            cursor.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated = ? WHERE id = ?",
+                (worker, now + self.lease_seconds, now, row["id"]),
+            )
+            return row["id"]
+
+        job_id = self._transaction(statements)
+        return self.get_job(job_id) if job_id is not None else None
+
+    def _check_lease(self, cursor, job_id, worker):
+        row = cursor.execute(
+            "SELECT worker, status FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None or row["worker"] != worker or row["status"] != "running":
+            raise LeaseLost(f"{worker} no longer holds job {job_id}")
+
+    def heartbeat(self, job_id, worker):
+        def statements(cursor):
+            self._check_lease(cursor, job_id, worker)
+            now = self.clock()
+            cursor.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ?",
+                (now + self.lease_seconds, now, job_id),
+            )
+
+        self._transaction(statements)
+
+    @contextmanager
+    def keep_lease(self, job_id, worker, interval=None):
+        """Renews the lease of `job_id` every `interval` seconds (a third of
+        the lease by default) while the block runs. Renewal stops once the
+        lease is lost; the next `heartbeat` or write raises `LeaseLost`."""
+        interval = self.lease_seconds / 3 if interval is None else interval
+        stopped = threading.Event()
+
+        def renew():
+            while not stopped.wait(interval):
+                try:
+                    self.heartbeat(job_id, worker)
+                except LeaseLost:
+                    return
+                except sqlite3.Error:
+                    # busy database, try again on the next tick
+                    continue
+
+        thread = threading.Thread(target=renew, name=f"lease-{job_id}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def save_artifact(self, job_id, worker, stage, name, content):
+        """Stores an artifact once; an existing artifact is kept as is.
+
+        Returns the sha256 of the stored content.
+        """
+        if isinstance(content, str):
+            content = content.encode()
+
+        def statements(cursor):
+            self._check_lease(cursor, job_id, worker)
+            now = self.clock()
+            cursor.execute(
+                "INSERT OR IGNORE INTO artifacts "
+                "(job_id, stage, name, content, sha256, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, stage, name, content, hashlib.sha256(content).hexdigest(), now),
+            )
+            cursor.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ?",
+                (now + self.lease_seconds, now, job_id),
+            )
+            return cursor.execute(
+                "SELECT sha256 FROM artifacts WHERE job_id = ? AND stage = ? AND name = ?",
+                (job_id, stage, name),
+            ).fetchone()["sha256"]
+
+        return self._transaction(statements)
+
+    def get_artifact(self, job_id, stage, name):
+        rows = self._query(
+            "SELECT content, sha256 FROM artifacts WHERE job_id = ? AND stage = ? AND name = ?",
+            (job_id, stage, name),
+        )
+        if not rows:
+            return None
+        content = bytes(rows[0]["content"])
+        if hashlib.sha256(content).hexdigest() != rows[0]["sha256"]:
+            raise ValueError(f"artifact {job_id}/{stage}/{name} is corrupted")
+        return content
+
+    def list_artifacts(self, job_id, stage=None):
+        if stage is None:
+            rows = self._query(
+                "SELECT stage, name, sha256 FROM artifacts WHERE job_id = ? "
+                "ORDER BY stage, name",
+                (job_id,),
+            )
+        else:
+            rows = self._query(
+                "SELECT stage, name, sha256 FROM artifacts WHERE job_id = ? AND stage = ? "
+                "ORDER BY name",
+                (job_id, stage),
+            )
+        return [dict(row) for row in rows]
+
+    def complete_stage(self, job_id, worker, stage):
+        def statements(cursor):
+            self._check_lease(cursor, job_id, worker)
+            cursor.execute(
+                "INSERT OR IGNORE INTO stages (job_id, stage, completed) VALUES (?, ?, ?)",
+                (job_id, stage, self.clock()),
+            )
+
+        self._transaction(statements)
+
+    def completed_stages(self, job_id):
+        rows = self._query("SELECT stage FROM stages WHERE job_id = ?", (job_id,))
+        return {row["stage"] for row in rows}
+
+    def finish(self, job_id, worker, status="done", error=None):
+        def statements(cursor):
+            self._check_lease(cursor, job_id, worker)
+            cursor.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_expires = NULL, updated = ? "
+                "WHERE id = ?",
+                (status, error, self.clock(), job_id),
+            )
+
+        self._transaction(statements)
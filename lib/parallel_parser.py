@@ -0,0 +1,157 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from lib.arena import ArenaTree
+from lib.exceptions import InvalidSSMLSyntax
+from lib.parser import SSMLEncloseTag, SSMLTree, markup_token_regex
+from utils.helpers import get_attribute_dict, paused_gc
+
+
+"""
+Parallel parsing of large SSML documents.
+
+The body of the root is cut between its top level children, the slices are
+parsed in a process pool straight into flat `ArenaTree`s (node objects with
+their sibling chains are slow to pickle), then materialized and stitched
+into one sibling chain under the root as they come back, while the workers
+go on with the later slices. The result is the same tree `SSMLTree.parse`
+builds; small documents, or anything the fast path isn't sure about, are
+parsed serially.
+
+Unpickling the arenas and creating the node objects stays in the parent and
+is about half the cost of a serial parse (3.3MB of S and Break tags, best
+of three runs: 0.51s serial parse, 0.26s unpickle and materialize), so the
+speedup tops out near 2x however many workers there are. That ceiling is
+derived from the parent's share, the multi-core speedup itself has not
+been measured: on the single CPU it was benchmarked on, a 5.2MB document
+took 1.0s serially and 1.3s with 2 or 4 workers.
+"""
+
+DEFAULT_MIN_PARALLEL_CHARS = 1_000_000
+SLICES_PER_WORKER = 4
+
+
+def tag_depth(ssml_text, start, end):
+    """Nesting change over `ssml_text[start:end]`, counting "<" for opening
+    tags, "</" for closing ones and "/>" for inline ones. Breaks written
+    without "/>" or stray "<" in text miscount, the slice parsers catch it."""
+    return (
+        ssml_text.count("<", start, end)
+        - 2 * ssml_text.count("</", start, end)
+        - ssml_text.count("/>", start, end)
+    )
+
+
+def split_body(ssml_text, body_start, body_end, slices):
+    """Offsets cutting the root body into up to `slices` even slices, each
+    cut right after a top level child."""
+    offsets = [body_start]
+    position = body_start
+    depth = 0
+    for k in range(1, slices):
+        target = max(body_start + (body_end - body_start) * k // slices, position)
+        lt = ssml_text.find("<", target, body_end)
+        if lt == -1:
+            break
+        depth += tag_depth(ssml_text, position, lt)
+        position = lt
+        for token in markup_token_regex.finditer(ssml_text, lt, body_end):
+            if token.start() != position and "<" in ssml_text[position : token.start()]:
+                return None
+            is_close, tagname, _, is_inline = token.groups()
+            if is_close:
+                depth -= 1
+            elif not is_inline and issubclass(
+                SSMLTree.token_types.get(tagname, SSMLEncloseTag), SSMLEncloseTag
+            ):
+                depth += 1
+            position = token.end()
+            if depth < 0:
+                return None
+            if depth == 0:
+                break
+        if depth != 0:
+            break
+        if position > offsets[-1] and position < body_end:
+            offsets.append(position)
+    offsets.append(body_end)
+    return offsets
+
+
+def parse_slice(body):
+    with paused_gc():
+        arena = ArenaTree(id=None, lang=None)
+        arena.parse_fragment(body)
+    return arena
+
+
+def parse_parallel(
+    ssml_text: str, workers=None, executor=None, min_chars=DEFAULT_MIN_PARALLEL_CHARS
+):
+    """Parses `ssml_text` like `SSMLTree.parse`, using `workers` processes
+    (the CPU count by default) for documents of at least `min_chars`
+    characters. An `executor` is used instead of a new pool, `workers` then
+    sets how many slices it gets."""
+    workers = workers or os.cpu_count() or 1
+    if len(ssml_text) < min_chars or workers < 2:
+        return SSMLTree.parse(ssml_text)
+
+    root_open = markup_token_regex.search(ssml_text)
+    if root_open is None or ssml_text[: root_open.start()].strip() != "":
+        return SSMLTree.parse(ssml_text)
+    is_close, tagname, tagattrib, is_inline = root_open.groups()
+    tag_class = SSMLTree.token_types.get(tagname)
+    if (
+        is_close
+        or is_inline
+        or tag_class is None
+        or not issubclass(tag_class, SSMLEncloseTag)
+    ):
+        return SSMLTree.parse(ssml_text)
+    body_start = root_open.end()
+    body_end = ssml_text.rfind("</")
+    root_close = markup_token_regex.match(ssml_text, body_end)
+    if (
+        body_end < body_start
+        or root_close is None
+        or root_close.group(2) != tagname
+        or ssml_text[root_close.end() :].strip() != ""
+    ):
+        return SSMLTree.parse(ssml_text)
+
+    offsets = split_body(ssml_text, body_start, body_end, workers * SLICES_PER_WORKER)
+    if offsets is None or len(offsets) < 3:
+        return SSMLTree.parse(ssml_text)
+    slices = [ssml_text[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    try:
+        if executor is None:
+            with ProcessPoolExecutor(workers) as pool:
+                return stitch_slices(tag_class, tagattrib, pool.map(parse_slice, slices))
+        return stitch_slices(tag_class, tagattrib, executor.map(parse_slice, slices))
+    except InvalidSSMLSyntax:
+        # a bad cut or a broken document, let the serial parser decide
+        return SSMLTree.parse(ssml_text)
+
+
+def stitch_slices(tag_class, tagattrib, arenas):
+    """Materializes the slice `arenas`, in order as they are produced, and
+    links their top level nodes under a new `tag_class` root."""
+    root_node = tag_class(**get_attribute_dict(tagattrib))
+    tail = None
+    with paused_gc():
+        for arena in arenas:
+            child = arena.materialize(arena.root.index).child_ptr
+            if child is None:
+                continue
+            if tail is None:
+                root_node.child_ptr = child
+            else:
+                tail.next_node = child
+                child.prev_node = tail
+            while child is not None:
+                child.parent_node = root_node
+                tail = child
+                child = child.next_node
+    root_node._last_child = tail
+    return root_node
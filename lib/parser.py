@@ -1,12 +1,13 @@
 from abc import ABC, abstractmethod
 from re import L
 import re
-from lib.exceptions import InvalidSSMLSyntax
+from lib.exceptions import InvalidSSMLStructure, InvalidSSMLSyntax
 
 from utils.constants import (
     CLOSE_TAG_PATTERN,
     ENCLOSED_TAG_PATTERN,
     INLINE_TAG_PATTERN,
+    MARKUP_TOKEN_PATTERN,
     TAG_PATTERN,
     TEXT_PATTERN,
 )
@@ -31,6 +32,22 @@ class BaseTag(object):
         self.next_node = None
         self.parent_node = None
 
+    _size = None
+
+    def markup_size(self):
+        """Characters and UTF-8 bytes of `str(self)`."""
+        markup = str(self)
+        return len(markup), len(markup) if markup.isascii() else len(markup.encode())
+
+    def invalidate_size(self):
+        """Drops the cached sizes of the node and of its ancestors."""
+        node = self if isinstance(self, SSMLEncloseTag) else self.parent_node
+        while node is not None:
+            if node._size is None and node is not self:
+                break
+            node._size = None
+            node = node.parent_node
+
     def is_root(self):
         return self.prev_node is None
 
@@ -104,10 +121,14 @@ class SSMLEncloseTag(BaseTag):
     def __init__(self, id=None, *args, **kwargs) -> None:
         super().__init__(id=id, *args, **kwargs)
         self.child_ptr = None
+        self._last_child = None
 
 
     def __str__(self) -> str:
-        return self.format_node('')
+        return self.format_node(self.format_attributes())
+
+    def format_attributes(self) -> str:
+        return ""
 
     def get_children(self):
         res = []
@@ -118,48 +139,88 @@ class SSMLEncloseTag(BaseTag):
             curr_node = curr_node.next_node
         return res
 
-    def add_child(self, node):
-        if self.__allowed_children__ != "__all__" and (
-            type(node) not in self.__allowed_children__
-            and node.__class__.__name__ not in self.__allowed_children__
-        ):
-
-            raise ValueError(
-                f"{node.__repr__()} is not a valid child for {self.__class__}"
-            )
-        if self == node:
-            raise ValueError("Can't add the object as it's child")
-
-        if node.parent_node is self:
-            raise ValueError(f"Can't add a node as it child, no circular references {self}")
-
-        curr_node = self.child_ptr
+    def add_child(self, node, trusted=False):
+        if not trusted:
+            try:
+                allowed = ALLOWED_CHILDREN[self.__class__]
+            except KeyError:
+                allowed = resolve_allowed_children(self.__class__)
+            if allowed is not None and type(node) not in allowed:
+                raise ValueError(
+                    f"{node.__repr__()} is not a valid child for {self.__class__}"
+                )
+            if self == node:
+                raise ValueError("Can't add the object as it's child")
+
+            if node.parent_node is self:
+                raise ValueError(f"Can't add a node as it child, no circular references {self}")
+
+        curr_node = self._last_child
+        if curr_node is None or curr_node.next_node is not None or curr_node.parent_node is not self:
+            curr_node = self.child_ptr
+            if curr_node is not None:
+                while curr_node.next_node is not None:
+                    curr_node = curr_node.next_node
         if curr_node is not None:
-            while curr_node.next_node is not None:
-                curr_node = curr_node.next_node
-
             node.prev_node = curr_node
             curr_node.next_node = node
         else:
             self.child_ptr = node
         node.parent_node = self
+        self._last_child = node
+        if self._size is not None:
+            self.invalidate_size()
         return node
 
-    def format_node(self, attrs: str) -> str:
-        children_nodes = "".join([str(node) for node in self.get_children()])
+    def format_tags(self, attrs=None):
+        """Opening and closing tags of the node, without its children."""
+        if attrs is None:
+            attrs = self.format_attributes()
         tag_name = self.__class__.__name__.lower()
         if attrs:
             attrs = " " + attrs
-        return f"<{tag_name}{attrs}>{children_nodes}</{tag_name}>"
+        return f"<{tag_name}{attrs}>", f"</{tag_name}>"
+
+    def format_node(self, attrs: str) -> str:
+        children_nodes = "".join([str(node) for node in self.get_children()])
+        open_tag, close_tag = self.format_tags(attrs)
+        return f"{open_tag}{children_nodes}{close_tag}"
+
+    def markup_size(self):
+        """Characters and UTF-8 bytes of `str(self)`.
+
+        Cached per node from the sizes of the children; adding or removing
+        children and setting `Text.text` drop the cache up to the root, call
+        `invalidate_size` after changing attributes of a node.
+        """
+        if self._size is None:
+            chars = 0
+            size = 0
+            for tag in self.format_tags():
+                chars += len(tag)
+                size += len(tag) if tag.isascii() else len(tag.encode())
+            curr_node = self.child_ptr
+            while curr_node is not None:
+                child_chars, child_size = curr_node.markup_size()
+                chars += child_chars
+                size += child_size
+                curr_node = curr_node.next_node
+            self._size = (chars, size)
+        return self._size
 
     def remove_node_and_swap_pointers(self, node):
         next_node = node.next_node
+        if self.child_ptr is node:
+            self.child_ptr = next_node
+        if self._last_child is node:
+            self._last_child = node.prev_node
         if node.prev_node is not None:
             node.prev_node.next_node = next_node
         if next_node is not None:
             next_node.prev_node = node.prev_node
         node.next_node = None
         node.prev_node = None
+        self.invalidate_size()
 
         return node
 
@@ -211,6 +272,17 @@ class Text(BaseTag):
             raise TypeError("Invalid type, text only recieves object of type str")
         self.__text = text
 
+    @property
+    def text(self) -> str:
+        return self.__text
+
+    @text.setter
+    def text(self, text: str) -> None:
+        if type(text) != str:
+            raise TypeError("Invalid type, text only recieves object of type str")
+        self.__text = text
+        self.invalidate_size()
+
     def startswith(self, *args, **kwargs):
         return self.__text.startswith(*args, **kwargs)
 
@@ -223,11 +295,13 @@ class Text(BaseTag):
     def upper(self, inplace=False, *args, **kwargs):
         if inplace:
             self.__text = self.__text.upper()
+            self.invalidate_size()
         return self.__text.upper(*args, **kwargs)
 
     def lower(self, inplace=False, *args, **kwargs):
         if inplace:
             self.__text = self.__text.lower()
+            self.invalidate_size()
         return self.__text.upper(*args, **kwargs)
 
     def isupper(self, *args, **kwargs):
@@ -262,12 +336,12 @@ class Speak(SSMLEncloseTag):
         super().__init__(id, *args, **kwargs)
         self.lang = lang
 
-    def __str__(self) -> str:
+    def format_attributes(self) -> str:
         attr_list = {"xml:lang": self.lang, "xml:id": self.id}
         attrs = " ".join(
             [f'{attr}="{val}"' for attr, val in attr_list.items() if bool(val)]
         )
-        return self.format_node(attrs)
+        return attrs
 
 
 class Audio(SSMLEncloseTag):
@@ -296,7 +370,7 @@ class Audio(SSMLEncloseTag):
         self.repeatDur = repeatDur
         self.soundLevel = soundLevel
 
-    def __str__(self) -> str:
+    def format_attributes(self) -> str:
         attr_list = {
             "src": self.src,
             "xml:id": self.id,
@@ -310,7 +384,7 @@ class Audio(SSMLEncloseTag):
         attrs = " ".join(
             [f'{attr}="{val}"' for attr, val in attr_list.items() if bool(val)]
         )
-        return self.format_node(attrs)
+        return attrs
 
 
 class Media(SSMLEncloseTag):
@@ -339,7 +413,7 @@ class Media(SSMLEncloseTag):
         self.fadeInDur = fadeInDur
         self.fadeOutDur = fadeOutDur
 
-    def __str__(self) -> str:
+    def format_attributes(self) -> str:
         attr_list = {
             "begin": self.begin,
             "xml:id": self.id,
@@ -353,7 +427,7 @@ class Media(SSMLEncloseTag):
         attrs = " ".join(
             [f'{attr}="{val}"' for attr, val in attr_list.items() if bool(val)]
         )
-        return self.format_node(attrs)
+        return attrs
 
 
 class Seq(SSMLEncloseTag):
@@ -371,14 +445,14 @@ class Par(SSMLEncloseTag):
     def __init__(self, id=None, *args, **kwargs) -> None:
         super().__init__(id, *args, **kwargs)
 
-    def __str__(self) -> str:
+    def format_attributes(self) -> str:
         attr_list = {
             "xml:id": self.id,
         }
         attrs = " ".join(
             [f'{attr}="{val}"' for attr, val in attr_list.items() if bool(val)]
         )
-        return self.format_node(attrs)
+        return attrs
 
 
 class Prosody(SSMLEncloseTag):
@@ -401,7 +475,7 @@ class Prosody(SSMLEncloseTag):
         self.volume = volume
         self.duration = duration
 
-    def __str__(self) -> str:
+    def format_attributes(self) -> str:
         attr_list = {
             "xml:id": self.id,
             "rate": self.rate,
@@ -413,13 +487,14 @@ class Prosody(SSMLEncloseTag):
         attrs = " ".join(
             [f'{attr}="{val}"' for attr, val in attr_list.items() if bool(val)]
         )
-        return self.format_node(attrs)
+        return attrs
 
 
 tag_pattern_regex = re.compile(ENCLOSED_TAG_PATTERN)
 inline_tag_pattern_regex = re.compile(INLINE_TAG_PATTERN)
 text_pattern_regex = re.compile(TEXT_PATTERN)
 opened_tag_regex = re.compile(TAG_PATTERN)
+markup_token_regex = re.compile(MARKUP_TOKEN_PATTERN)
 
 
 class S(SSMLEncloseTag):
@@ -430,14 +505,14 @@ class S(SSMLEncloseTag):
         super().__init__(id, *args, **kwargs)
 
     
-    def __str__(self) -> str:
+    def format_attributes(self) -> str:
         attr_list = {
             "xml:id": self.id,
         }
         attrs = " ".join(
             [f'{attr}="{val}"' for attr, val in attr_list.items() if bool(val)]
         )
-        return self.format_node(attrs)
+        return attrs
 
 
 class P(SSMLEncloseTag):
@@ -446,14 +521,138 @@ class P(SSMLEncloseTag):
     def __init__(self, id=None, *args, **kwargs) -> None:
         super().__init__(id, *args, **kwargs)
 
-    def __str__(self) -> str:
+    def format_attributes(self) -> str:
         attr_list = {
             "xml:id": self.id,
         }
         attrs = " ".join(
             [f'{attr}="{val}"' for attr, val in attr_list.items() if bool(val)]
         )
-        return self.format_node(attrs)
+        return attrs
+
+
+def get_tag_classes():
+    tag_classes = []
+    pending = [BaseTag]
+    while len(pending) != 0:
+        cls = pending.pop()
+        tag_classes.append(cls)
+        pending.extend(cls.__subclasses__())
+    return tag_classes
+
+
+def resolve_allowed_children(cls):
+    """Resolves `__allowed_children__` of `cls` into a set of classes.
+
+    String entries are matched against the class names of every known tag,
+    `None` means any child is accepted.
+    """
+    allowed = cls.__allowed_children__
+    if allowed == "__all__":
+        resolved = None
+    else:
+        tags_by_name = {}
+        for tag_class in get_tag_classes():
+            tags_by_name.setdefault(tag_class.__name__, set()).add(tag_class)
+        resolved = set()
+        for entry in allowed:
+            if isinstance(entry, str):
+                resolved |= tags_by_name.get(entry, set())
+            else:
+                resolved.add(entry)
+        resolved = frozenset(resolved)
+    ALLOWED_CHILDREN[cls] = resolved
+    return resolved
+
+
+# parent class -> frozenset of child classes it accepts (None accepts all)
+ALLOWED_CHILDREN = {}
+
+for tag_class in get_tag_classes():
+    if issubclass(tag_class, SSMLEncloseTag):
+        resolve_allowed_children(tag_class)
+
+
+class Violation(object):
+    def __init__(self, path, node, message) -> None:
+        self.path = path
+        self.node = node
+        self.message = message
+
+    def __repr__(self) -> str:
+        return f"Violation({self.path!r}, {self.message!r})"
+
+    def __str__(self) -> str:
+        return f"{self.path}: {self.message}"
+
+
+class NodeValidator:
+    @staticmethod
+    def node_path(parent_path, node, position):
+        return f"{parent_path}/{node.__class__.__name__.lower()}[{position}]"
+
+    @staticmethod
+    def validate(start_node):
+        """Checks a whole (sub)tree in a single pass.
+
+        Every node is checked against the allowed children of its parent and
+        for broken parent/sibling links; all violations are returned, each
+        with the path of the offending node, e.g. `speak/s[3]/break[0]`.
+        """
+        violations = []
+        root_path = start_node.__class__.__name__.lower()
+        traverse_stack = [(start_node, root_path)]
+        visited = {id(start_node)}
+
+        while len(traverse_stack) != 0:
+            node, path = traverse_stack.pop()
+            if not isinstance(node, SSMLEncloseTag):
+                continue
+            try:
+                allowed = ALLOWED_CHILDREN[node.__class__]
+            except KeyError:
+                allowed = resolve_allowed_children(node.__class__)
+
+            prev_child = None
+            child = node.child_ptr
+            position = 0
+            children = []
+            while child is not None:
+                child_path = NodeValidator.node_path(path, child, position)
+                if not isinstance(child, BaseTag):
+                    violations.append(
+                        Violation(child_path, child, f"{child!r} is not a SSML node")
+                    )
+                    break
+                if allowed is not None and type(child) not in allowed:
+                    violations.append(
+                        Violation(
+                            child_path,
+                            child,
+                            f"{child.__class__.__name__} is not a valid child for {node.__class__.__name__}",
+                        )
+                    )
+                if child.parent_node is not node:
+                    violations.append(
+                        Violation(child_path, child, "parent_node doesn't point to its parent")
+                    )
+                if child.prev_node is not prev_child:
+                    violations.append(
+                        Violation(child_path, child, "prev_node doesn't point to the previous sibling")
+                    )
+                if id(child) in visited:
+                    violations.append(
+                        Violation(child_path, child, "node appears more than once in the tree")
+                    )
+                    break
+                visited.add(id(child))
+                children.append((child, child_path))
+                prev_child = child
+                child = child.next_node
+                position += 1
+            traverse_stack.extend(reversed(children))
+        return violations
+
 
 class SSMLTree:
 
@@ -464,10 +663,13 @@ class SSMLTree:
         "prosody": Prosody,
         "seq": Seq,
         "par": Par,
+        "audio": Audio,
+        "s": S,
+        "p": P,
     }
 
-    def __init__(self) -> None:
-        self.__root = Speak(id="root", lang="en")
+    def __init__(self, root=None) -> None:
+        self.__root = root if root is not None else Speak(id="root", lang="en")
 
     def __str__(self) -> str:
         return str(self.__root)
@@ -476,8 +678,8 @@ class SSMLTree:
     def root(self):
         return self.__root
 
-    def add_child(self, node):
-        return self.__root.add_child(node)
+    def add_child(self, node, trusted=False):
+        return self.__root.add_child(node, trusted=trusted)
 
     def find(self, tag):
         return NodeTraversal.find(self.__root, tag)
@@ -491,6 +693,12 @@ class SSMLTree:
     def traverse_tree(self):
         return NodeTraversal.traverse_list(self.__root)
 
+    def validate(self, raise_error=False):
+        violations = NodeValidator.validate(self.__root)
+        if raise_error and len(violations) != 0:
+            raise InvalidSSMLStructure(violations)
+        return violations
+
     def write_to_file(self, filename):
         with open(f"{filename}.xml", "w") as f:
             f.write(str(self.__root))
@@ -498,6 +706,10 @@ class SSMLTree:
     def to_markup_string(self):
         return str(self.__root)
 
+    @classmethod
+    def from_markup_string(cls, ssml_text: str):
+        return cls(SSMLTree.parse(ssml_text))
+
     @staticmethod
     def get_text_index(text: str, substr: str, lastindex: int) -> float:
         try:
@@ -559,84 +771,57 @@ class SSMLTree:
 
     @staticmethod
     def parse(ssml_text: str):
-        try:
-            tag_match = tag_pattern_regex.match(ssml_text).groups()
-            if tag_match is None:
-                raise InvalidSSMLSyntax('document must be closed in a tag.')
-            if tag_match[0].strip() != tag_match[-1].strip():
-                raise InvalidSSMLSyntax(f"The tag {tag_match[0]} wasn't closed.")
-            attributes = tag_match[1]
-            body = tag_match[2]
+        """Parses a SSML document into its root node.
+
+        The document is scanned once; nodes are linked through the trusted
+        `add_child` path, use `NodeValidator.validate` to check the result.
+        """
+        root_node = None
+        opened_tags = []
+        last_index = 0
+
+        for token in markup_token_regex.finditer(ssml_text):
+            text = ssml_text[last_index : token.start()]
+            last_index = token.end()
+            if text.strip() != "":
+                if len(opened_tags) == 0:
+                    raise InvalidSSMLSyntax("document must be closed in a tag.")
+                opened_tags[-1].add_child(Text(text.strip("\n")), trusted=True)
+
+            is_close, tagname, tagattrib, is_inline = token.groups()
+            if is_close:
+                if len(opened_tags) == 0:
+                    raise InvalidSSMLSyntax(f"The tag {tagname} was never opened.")
+                last_tagname = opened_tags[-1].__class__.__name__.lower()
+                if tagname != last_tagname:
+                    raise InvalidSSMLSyntax(
+                        f"The last opened tag <{last_tagname}> was not closed!"
+                    )
+                opened_tags.pop()
+                if len(opened_tags) == 0:
+                    break
+                continue
+
             try:
-                tag_class = SSMLTree.token_types[tag_match[0].strip()]
+                tag_class = SSMLTree.token_types[tagname]
             except KeyError:
                 raise InvalidSSMLSyntax(f"{tagname} is a Invalid tag.")
+            node = tag_class(**get_attribute_dict(tagattrib))
 
-            root_node = tag_class(**get_attribute_dict(attributes))
-
-
-            child_tags = SSMLTree.get_child_tags(body)
-
-            text_tokens = [ t for t in text_pattern_regex.findall(body) if t != '']
-            tag_tokens = child_tags["tags"]
+            if len(opened_tags) != 0:
+                opened_tags[-1].add_child(node, trusted=True)
+            elif root_node is None and isinstance(node, SSMLEncloseTag):
+                root_node = node
+            else:
+                raise InvalidSSMLSyntax("document must be closed in a tag.")
 
-            cleaned_text = body
-            for start_pos, end_pos in child_tags["pos"]:
-                cleaned_text = cleaned_text[: start_pos + 1] + cleaned_text[end_pos:]
-            inline_tokens = [
-                tag[0] for tag in inline_tag_pattern_regex.findall(cleaned_text)
-            ]
-            token_last_index = {}
-
-            ordered_children = []
-            tokens = [text_tokens, tag_tokens, inline_tokens]
-
-            while len(tokens[0]) or len(tokens[1]) or len(tokens[2]):
-                min_token_idx = None
-                min_token_pos = float("inf")
-                for i in range(len(tokens)):
-                    if len(tokens[i]) != 0:
-                        curr_token = tokens[i][0]
-                        lastindex = token_last_index.get(curr_token, 0)
-                        tag_pos = SSMLTree.get_text_index(
-                            body, curr_token, lastindex
-                        )
-                        token_last_index[curr_token] = tag_pos
-                        if tag_pos < min_token_pos:
-                            min_token_pos = tag_pos
-                            min_token_idx = i
-                token = tokens[min_token_idx].pop(0)
-                ordered_children.append(token.strip("\n"))
-
-            childhead = None
-            last_node = None
-            for i, token in enumerate(ordered_children):
-                is_text = re.match('[^<>]+', token)
-                is_inline = inline_tag_pattern_regex.match(token)
-                is_tag = tag_pattern_regex.match(token)
-                if token == '': continue
-                if is_text is not None:
-                    node = Text(token)
-                elif is_inline is not None:
-                    _, tagname, tagattrib = is_inline.groups()
-                    try:
-                        tag_class = SSMLTree.token_types[tagname]
-                        attribute_dict = get_attribute_dict(tagattrib)
-                        node = tag_class(**attribute_dict)
-                    except KeyError:
-                        raise InvalidSSMLSyntax(f"{tagname} is a Invalid tag.")
-                elif is_tag:
-                    node = SSMLTree.parse(token)
-                else:
-                    raise InvalidSSMLSyntax(f'Invalid pattern {token}.')
-                if i == 0:
-                    childhead = node
-                if last_node is not None:
-                    last_node.next_node = node
-                    node.prev_node = last_node
-                last_node = node
-            root_node.child_ptr = childhead
-            return root_node
-        except Exception as ex:
-            raise ex
+            if isinstance(node, SSMLEncloseTag) and not is_inline:
+                opened_tags.append(node)
 
+        if len(opened_tags) != 0:
+            raise InvalidSSMLSyntax(
+                f"The tag {opened_tags[-1].__class__.__name__.lower()} wasn't closed."
+            )
+        if root_node is None:
+            raise InvalidSSMLSyntax("document must be closed in a tag.")
+        return root_node
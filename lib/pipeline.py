@@ -0,0 +1,214 @@
+import json
+
+from lib.backends import get_caption_reader
+from lib.exceptions import SubtitlesNotFound
+from lib.parser import SSMLTree
+from lib.translation import collect_text_nodes, translate_tree, write_translations
+from lib.transpiler import convert_vtt_text_to_ssml
+from lib.tts_planner import plan_requests
+from lib.youtube_data import YouTubeData
+
+
+"""
+The steps of a translate job, from a video url to synthesized audio chunks.
+
+Every step is a plain function so it can run in a thread (network bound
+steps) or a process pool (`build_ssml`, `ssml_texts`, `apply_translations`,
+`chunk_ssml`, CPU bound).
+"""
+
+DEFAULT_CHUNK_CHARS = 4000
+
+STAGES = ("info", "subtitles", "ssml", "translation", "synthesis")
+
+
+def fetch_subtitles(video_backend, url, lang, format="vtt", info=None):
+    """Returns the video info and its `lang` subtitles; `info["automatic"]`
+    tells if they are automatic captions, whose rolling cues get collapsed."""
+    video = YouTubeData(url, backend=video_backend, info=info)
+    subtitles_url, automatic = video.find_subtitle(lang, format)
+    if subtitles_url is None:
+        raise SubtitlesNotFound(f"No {lang} {format} subtitles for {url}")
+    subtitles = video_backend.fetch_text(subtitles_url)
+    info = {"id": video.video_id, "title": video.title, "automatic": automatic}
+    return info, subtitles
+
+
+def chunk_ssml_tree(tree, max_chars=DEFAULT_CHUNK_CHARS, max_bytes=None):
+    """Packs `tree` into the fewest `<speak>` documents of at most
+    `max_chars` characters and `max_bytes` bytes, see `plan_requests`."""
+    return [
+        request.ssml
+        for request in plan_requests(tree, max_bytes=max_bytes, max_characters=max_chars)
+    ]
+
+
+def build_ssml(vtt_text, reader="webvtt", collapse=False):
+    tree = convert_vtt_text_to_ssml(vtt_text, get_caption_reader(reader), collapse)
+    return tree.to_markup_string()
+
+
+def translate_ssml(markup, target, translator, source=None, memory=None):
+    tree = SSMLTree.from_markup_string(markup)
+    stats = translate_tree(tree, target, translator, source=source, memory=memory)
+    tree.root.lang = target
+    return tree.to_markup_string(), stats
+
+
+def ssml_texts(markup):
+    """Text payloads of a SSML document, in document order."""
+    return [str(node) for node in collect_text_nodes(SSMLTree.parse(markup))]
+
+
+def apply_translations(markup, translations, target):
+    """Rewrites a SSML document with the `translations` of its texts."""
+    tree = SSMLTree.from_markup_string(markup)
+    write_translations(collect_text_nodes(tree.root), translations)
+    tree.root.lang = target
+    return tree.to_markup_string()
+
+
+def chunk_ssml(markup, max_chars=DEFAULT_CHUNK_CHARS, max_bytes=None):
+    return chunk_ssml_tree(SSMLTree.from_markup_string(markup), max_chars, max_bytes)
+
+
+def build_ssml_chunks(
+    vtt_text,
+    reader="webvtt",
+    max_chars=DEFAULT_CHUNK_CHARS,
+    max_bytes=None,
+    collapse=False,
+):
+    tree = convert_vtt_text_to_ssml(vtt_text, get_caption_reader(reader), collapse)
+    return chunk_ssml_tree(tree, max_chars, max_bytes)
+
+
+def run_checkpointed_job(
+    store,
+    job,
+    worker,
+    video_backend,
+    speech_backend,
+    caption_reader="webvtt",
+    chunk_chars=DEFAULT_CHUNK_CHARS,
+    translator=None,
+    source_lang="en",
+    memory=None,
+    limiter=None,
+):
+    """Runs the stages of a claimed `job`, skipping every completed stage.
+
+    Artifacts are read back from `store` rather than recomputed, and the
+    synthesis stage resumes after the last synthesized chunk. With a
+    `translator` the `source_lang` subtitles are translated to the job
+    language, otherwise the job language subtitles are used as they are.
+    Chunks fit the speech backend's request size and, with a `limiter`
+    (a `TokenBucket` of characters), are paced to its quota. The lease is
+    renewed while the stages run and checked again before every paid call.
+    """
+    with store.keep_lease(job["id"], worker):
+        return _run_stages(
+            store,
+            job,
+            worker,
+            video_backend,
+            speech_backend,
+            caption_reader,
+            chunk_chars,
+            translator,
+            source_lang,
+            memory,
+            limiter,
+        )
+
+
+def _run_stages(
+    store,
+    job,
+    worker,
+    video_backend,
+    speech_backend,
+    caption_reader,
+    chunk_chars,
+    translator,
+    source_lang,
+    memory,
+    limiter,
+):
+    job_id = job["id"]
+    completed = store.completed_stages(job_id)
+
+    if "info" not in completed:
+        info = video_backend.extract_info(job["url"])
+        store.save_artifact(job_id, worker, "info", "info.json", json.dumps(info, default=str))
+        store.complete_stage(job_id, worker, "info")
+    info = json.loads(store.get_artifact(job_id, "info", "info.json"))
+
+    if "subtitles" not in completed:
+        subtitles_lang = source_lang if translator is not None else job["lang"]
+        track, subtitles = fetch_subtitles(
+            video_backend, job["url"], subtitles_lang, info=info
+        )
+        store.save_artifact(job_id, worker, "subtitles", "subtitles.vtt", subtitles)
+        store.save_artifact(
+            job_id,
+            worker,
+            "subtitles",
+            "subtitles.json",
+            json.dumps({"automatic": track["automatic"]}),
+        )
+        store.complete_stage(job_id, worker, "subtitles")
+    subtitles = store.get_artifact(job_id, "subtitles", "subtitles.vtt").decode()
+    # jobs checkpointed before the track kind was recorded aren't collapsed
+    track = json.loads(
+        store.get_artifact(job_id, "subtitles", "subtitles.json") or '{"automatic": false}'
+    )
+
+    if "ssml" not in completed:
+        markup = build_ssml(subtitles, caption_reader, collapse=track["automatic"])
+        store.save_artifact(job_id, worker, "ssml", "tree.ssml", markup)
+        store.complete_stage(job_id, worker, "ssml")
+    markup = store.get_artifact(job_id, "ssml", "tree.ssml").decode()
+
+    if "translation" not in completed:
+        if translator is not None:
+            store.heartbeat(job_id, worker)
+            translated, stats = translate_ssml(
+                markup, job["lang"], translator, source_lang, memory
+            )
+            store.save_artifact(job_id, worker, "translation", "tree.ssml", translated)
+            store.save_artifact(
+                job_id, worker, "translation", "stats.json", json.dumps(stats.to_dict())
+            )
+        store.complete_stage(job_id, worker, "translation")
+    translated = store.get_artifact(job_id, "translation", "tree.ssml")
+    if translated is not None:
+        markup = translated.decode()
+
+    if "synthesis" not in completed:
+        chunks = store.get_artifact(job_id, "synthesis", "chunks.json")
+        if chunks is None:
+            chunks = chunk_ssml(markup, chunk_chars, speech_backend.max_request_bytes)
+            store.save_artifact(job_id, worker, "synthesis", "chunks.json", json.dumps(chunks))
+        else:
+            chunks = json.loads(chunks)
+        synthesized = {
+            artifact["name"] for artifact in store.list_artifacts(job_id, "synthesis")
+        }
+        for index, chunk in enumerate(chunks):
+            name = f"chunk-{index:05d}"
+            if name in synthesized:
+                continue
+            if limiter is not None:
+                limiter.acquire(len(chunk))
+            store.heartbeat(job_id, worker)
+            audio = speech_backend.synthesize(chunk, job["lang"], job["voice"])
+            store.save_artifact(job_id, worker, "synthesis", name, audio)
+        store.complete_stage(job_id, worker, "synthesis")
+
+    store.finish(job_id, worker)
+    return [
+        artifact
+        for artifact in store.list_artifacts(job_id, "synthesis")
+        if artifact["name"].startswith("chunk-")
+    ]
@@ -0,0 +1,483 @@
+"""Long running translation service.
+
+    python -m lib.service --port 8080
+    python -m lib.service --fake --latency 0.05   # offline, for load tests
+
+HTTP API:
+    POST /jobs               {"url", "lang", "voice"?, "tenant"?} -> 202 job
+    GET  /jobs/<id>          job status
+    GET  /jobs/<id>/stream   newline delimited JSON events, audio chunks are
+                             sent base64 encoded as soon as they are ready
+    GET  /health             queue and worker state
+
+Jobs wait in a bounded queue (429 once it is full) and each tenant runs at
+most `tenant_concurrency` jobs at a time. Finished jobs are forgotten after
+`finished_ttl` seconds or once more than `max_finished_jobs` are kept, and
+audio chunks are released as soon as a stream has sent them. The backends and their clients are
+created once and shared by every job; building the SSML runs in a process
+pool so it doesn't stall the event loop. With `characters_per_minute` the
+synthesis requests of all jobs share one token bucket sized to that quota.
+"""
+import argparse
+import asyncio
+import base64
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+import json
+import time
+import uuid
+
+from lib.backends import (
+    FakeSpeechBackend,
+    FakeVideoBackend,
+    StubTranslator,
+    get_speech_backend,
+    get_translator,
+    get_video_backend,
+)
+from lib.exceptions import QueueFull
+from lib.pipeline import (
+    DEFAULT_CHUNK_CHARS,
+    apply_translations,
+    build_ssml,
+    build_ssml_chunks,
+    chunk_ssml,
+    fetch_subtitles,
+    ssml_texts,
+)
+from lib.translation import TranslationMemory, translate_texts
+from lib.tts_planner import TokenBucket
+
+
+HTTP_REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+}
+
+
+class Job(object):
+    def __init__(self, url, lang, voice=None, tenant="default") -> None:
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.lang = lang
+        self.voice = voice
+        self.tenant = tenant
+        self.status = "queued"
+        self.error = None
+        self.info = {}
+        self.results = []
+        self.chunks = 0
+        self.finished_at = None
+        self.events = []
+        self.changed = asyncio.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "url": self.url,
+            "lang": self.lang,
+            "voice": self.voice,
+            "tenant": self.tenant,
+            "status": self.status,
+            "error": self.error,
+            "title": self.info.get("title"),
+            "chunks": self.chunks,
+        }
+
+
+class TranslationService(object):
+    def __init__(
+        self,
+        speech_backend=None,
+        video_backend=None,
+        caption_reader="webvtt",
+        workers=8,
+        queue_size=100,
+        tenant_concurrency=2,
+        chunk_chars=DEFAULT_CHUNK_CHARS,
+        process_pool=None,
+        translator=None,
+        source_lang="en",
+        translation_memory=None,
+        characters_per_minute=None,
+        finished_ttl=3600,
+        max_finished_jobs=1000,
+        max_body_bytes=65536,
+    ) -> None:
+        self.speech_backend = speech_backend or get_speech_backend()
+        self.video_backend = video_backend or get_video_backend()
+        self.caption_reader = caption_reader
+        self.workers = workers
+        self.queue_size = queue_size
+        self.tenant_concurrency = tenant_concurrency
+        self.chunk_chars = chunk_chars
+        self.process_pool = process_pool
+        self.translator = translator
+        self.source_lang = source_lang
+        self.translation_memory = translation_memory
+        self.limiter = None
+        if characters_per_minute:
+            self.limiter = TokenBucket.per_minute(characters_per_minute)
+        self.finished_ttl = finished_ttl
+        self.max_finished_jobs = max_finished_jobs
+        self.max_body_bytes = max_body_bytes
+        self.jobs = {}
+        self.finished = deque()
+        self.pending = deque()
+        self.running = defaultdict(int)
+        self._scheduler = asyncio.Condition()
+        self._tasks = []
+
+    async def start(self):
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor()
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.process_pool.shutdown(cancel_futures=True)
+
+    def evict_finished(self, now=None):
+        """Forgets finished jobs older than `finished_ttl` or beyond
+        `max_finished_jobs`, oldest first."""
+        now = time.monotonic() if now is None else now
+        while self.finished and (
+            len(self.finished) > self.max_finished_jobs
+            or now - self.finished[0].finished_at > self.finished_ttl
+        ):
+            job = self.finished.popleft()
+            self.jobs.pop(job.id, None)
+
+    async def submit(self, url, lang, voice=None, tenant="default"):
+        for name, value in [("url", url), ("lang", lang), ("voice", voice), ("tenant", tenant)]:
+            if value is not None and not isinstance(value, str):
+                raise ValueError(f"{name} must be a string")
+        self.evict_finished()
+        async with self._scheduler:
+            if len(self.pending) >= self.queue_size:
+                raise QueueFull(f"{len(self.pending)} jobs are already queued")
+            job = Job(url, lang, voice=voice, tenant=tenant)
+            self.jobs[job.id] = job
+            self.pending.append(job)
+            self._scheduler.notify_all()
+        return job
+
+    def _next_runnable(self):
+        for job in self.pending:
+            if self.running[job.tenant] < self.tenant_concurrency:
+                self.pending.remove(job)
+                self.running[job.tenant] += 1
+                return job
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self._scheduler:
+                job = await self._scheduler.wait_for(self._next_runnable)
+            try:
+                await self.run_job(job)
+            except Exception as ex:
+                # run_job records the failures of a job, this only keeps a
+                # bug in it from taking the worker down
+                if not job.finished:
+                    job.status = "failed"
+                    job.error = str(ex)
+                    await self._finish(job)
+            finally:
+                async with self._scheduler:
+                    self.running[job.tenant] -= 1
+                    self._scheduler.notify_all()
+
+    async def _emit(self, job, event, **data):
+        async with job.changed:
+            job.events.append(dict(event=event, **data))
+            job.changed.notify_all()
+
+    async def run_job(self, job):
+        loop = asyncio.get_running_loop()
+        job.status = "running"
+        await self._emit(job, "status", status=job.status)
+        try:
+            subtitles_lang = self.source_lang if self.translator else job.lang
+            job.info, subtitles = await asyncio.to_thread(
+                fetch_subtitles, self.video_backend, job.url, subtitles_lang
+            )
+            await self._emit(job, "subtitles", title=job.info["title"], chars=len(subtitles))
+
+            if self.translator is None:
+                chunks = await loop.run_in_executor(
+                    self.process_pool,
+                    build_ssml_chunks,
+                    subtitles,
+                    self.caption_reader,
+                    self.chunk_chars,
+                    self.speech_backend.max_request_bytes,
+                    job.info["automatic"],
+                )
+            else:
+                markup = await loop.run_in_executor(
+                    self.process_pool,
+                    build_ssml,
+                    subtitles,
+                    self.caption_reader,
+                    job.info["automatic"],
+                )
+                # parsing and serializing go to the process pool, only the
+                # translator calls run in threads
+                texts = await loop.run_in_executor(self.process_pool, ssml_texts, markup)
+                translations, stats = await asyncio.to_thread(
+                    translate_texts,
+                    texts,
+                    job.lang,
+                    self.translator,
+                    self.source_lang,
+                    self.translation_memory,
+                )
+                markup = await loop.run_in_executor(
+                    self.process_pool, apply_translations, markup, translations, job.lang
+                )
+                await self._emit(job, "translation", **stats.to_dict())
+                chunks = await loop.run_in_executor(
+                    self.process_pool,
+                    chunk_ssml,
+                    markup,
+                    self.chunk_chars,
+                    self.speech_backend.max_request_bytes,
+                )
+            await self._emit(job, "ssml", chunks=len(chunks))
+
+            for index, chunk in enumerate(chunks):
+                if self.limiter is not None:
+                    await self.limiter.acquire_async(len(chunk))
+                audio = await asyncio.to_thread(
+                    self.speech_backend.synthesize, chunk, job.lang, job.voice
+                )
+                job.results.append(audio)
+                job.chunks += 1
+                await self._emit(job, "audio", index=index, bytes=len(audio))
+            job.status = "done"
+        except Exception as ex:
+            job.status = "failed"
+            job.error = str(ex)
+        await self._finish(job)
+
+    async def _finish(self, job):
+        job.finished_at = time.monotonic()
+        self.finished.append(job)
+        self.evict_finished()
+        await self._emit(job, "status", status=job.status, error=job.error)
+
+    async def stream_events(self, job):
+        sent = 0
+        while True:
+            async with job.changed:
+                await job.changed.wait_for(lambda: len(job.events) > sent)
+                events = job.events[sent:]
+            sent += len(events)
+            for event in events:
+                if event["event"] == "audio":
+                    # each chunk is sent once, then released
+                    audio = job.results[event["index"]]
+                    job.results[event["index"]] = None
+                    if audio is None:
+                        event = dict(event, released=True)
+                    else:
+                        event = dict(event, audio=base64.b64encode(audio).decode())
+                yield event
+            if job.finished and sent == len(job.events):
+                return
+
+    # HTTP
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, path, _ = request_line.decode().split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, value = line.decode().split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length < 0:
+                raise ValueError(f"invalid content-length {length}")
+            if length > self.max_body_bytes:
+                return await self.write_json(
+                    writer, 413, {"error": f"body over {self.max_body_bytes} bytes"}
+                )
+            body = await reader.readexactly(length)
+            await self.route(method, path.split("?")[0], headers, body, writer)
+        except (ValueError, asyncio.IncompleteReadError):
+            await self.write_json(writer, 400, {"error": "malformed request"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, headers, body, writer):
+        parts = [part for part in path.split("/") if part]
+        if parts == ["health"]:
+            return await self.write_json(
+                writer,
+                200,
+                {"queued": len(self.pending), "running": sum(self.running.values())},
+            )
+        if not parts or parts[0] != "jobs":
+            return await self.write_json(writer, 404, {"error": "not found"})
+
+        if len(parts) == 1:
+            if method != "POST":
+                return await self.write_json(writer, 405, {"error": "use POST"})
+            try:
+                payload = json.loads(body or b"{}")
+                url, lang = payload["url"], payload["lang"]
+            except (ValueError, KeyError, TypeError):
+                return await self.write_json(
+                    writer, 400, {"error": "expected a JSON body with url and lang"}
+                )
+            tenant = payload.get("tenant")
+            if tenant is None:
+                tenant = headers.get("x-tenant", "default")
+            try:
+                job = await self.submit(url, lang, payload.get("voice"), tenant)
+            except ValueError as ex:
+                return await self.write_json(writer, 400, {"error": str(ex)})
+            except QueueFull as ex:
+                return await self.write_json(
+                    writer, 429, {"error": str(ex)}, {"Retry-After": "1"}
+                )
+            return await self.write_json(writer, 202, job.to_dict())
+
+        job = self.jobs.get(parts[1])
+        if job is None:
+            return await self.write_json(writer, 404, {"error": "unknown job"})
+        if len(parts) == 2:
+            return await self.write_json(writer, 200, job.to_dict())
+        if parts[2] == "stream":
+            return await self.write_stream(writer, self.stream_events(job))
+        return await self.write_json(writer, 404, {"error": "not found"})
+
+    @staticmethod
+    def write_head(writer, status, headers):
+        lines = [f"HTTP/1.1 {status} {HTTP_REASONS[status]}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+
+    async def write_json(self, writer, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.write_head(
+            writer,
+            status,
+            dict(
+                {
+                    "Content-Type": "application/json",
+                    "Content-Length": len(body),
+                    "Connection": "close",
+                },
+                **(headers or {}),
+            ),
+        )
+        writer.write(body)
+        await writer.drain()
+
+    async def write_stream(self, writer, events):
+        self.write_head(
+            writer,
+            200,
+            {
+                "Content-Type": "application/x-ndjson",
+                "Transfer-Encoding": "chunked",
+                "Connection": "close",
+            },
+        )
+        async for event in events:
+            line = (json.dumps(event) + "\n").encode()
+            writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        await self.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Listening on {host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.stop()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8080)
+    arg_parser.add_argument("--workers", type=int, default=8)
+    arg_parser.add_argument("--queue-size", type=int, default=100)
+    arg_parser.add_argument("--tenant-concurrency", type=int, default=2)
+    arg_parser.add_argument(
+        "--fake", action="store_true", help="use offline backends for load testing"
+    )
+    arg_parser.add_argument(
+        "--latency", type=float, default=0.0, help="latency of the fake backends"
+    )
+    arg_parser.add_argument(
+        "--translate", action="store_true", help="translate the source subtitles"
+    )
+    arg_parser.add_argument("--source-lang", default="en")
+    arg_parser.add_argument(
+        "--translation-memory", help="SQLite file of the translation memory"
+    )
+    arg_parser.add_argument(
+        "--characters-per-minute",
+        type=int,
+        help="text to speech quota, requests are paced to stay under it",
+    )
+    args = arg_parser.parse_args(argv)
+
+    if args.fake:
+        backends = {
+            "speech_backend": FakeSpeechBackend(latency=args.latency),
+            "video_backend": FakeVideoBackend(latency=args.latency),
+            "caption_reader": "basic",
+        }
+    else:
+        backends = {}
+    if args.translate:
+        backends["translator"] = (
+            StubTranslator(latency=args.latency) if args.fake else get_translator()
+        )
+        backends["translation_memory"] = TranslationMemory(args.translation_memory)
+    service = TranslationService(
+        workers=args.workers,
+        queue_size=args.queue_size,
+        tenant_concurrency=args.tenant_concurrency,
+        source_lang=args.source_lang,
+        characters_per_minute=args.characters_per_minute,
+        **backends,
+    )
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
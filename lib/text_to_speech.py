@@ -4,36 +4,37 @@ Make sure to be working in a virtual environment.
 Note: ssml must be well-formed according to:
     https://www.w3.org/TR/speech-synthesis/
 """
-from google.cloud import texttospeech
-from lib.transpiler import convert_vtt_to_ssml
-# Instantiates a client
-
-
-# Set the text input to be synthesized
-
-def generate_audio_from_ssml(ssmltext, lang):
-    client = texttospeech.TextToSpeechClient()
-    synthesis_input = texttospeech.SynthesisInput(ssml=ssmltext )
-
-    # Build the voice request, select the language code ("en-US") and the ssml
-    # voice gender ("neutral")
-    voice = texttospeech.VoiceSelectionParams(
-        language_code=lang, ssml_gender=texttospeech.SsmlVoiceGender.MALE
-    )
-
-    # Select the type of audio file you want returned
-    audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.MP3
-    )
-
-    # Perform the text-to-speech request on the text input with the selected
-    # voice parameters and audio file type
-    response = client.synthesize_speech(
-        input=synthesis_input, voice=voice, audio_config=audio_config
-    )
+from lib.backends import get_speech_backend
+from lib.parser import SSMLTree
+from lib.tts_planner import plan_requests
+
+
+def generate_audio_from_ssml(
+    ssmltext, lang, voice=None, backend=None, filename="output.mp3", limiter=None
+):
+    # The backend holds a single client, the google library is only
+    # imported when the first request is made
+    if backend is None:
+        backend = get_speech_backend()
+
+    # Documents over the backend's request size are split into several
+    # requests, the mp3 frames of the responses are simply concatenated
+    requests = [ssmltext]
+    max_bytes = backend.max_request_bytes
+    if max_bytes is not None and len(ssmltext.encode()) > max_bytes:
+        requests = [
+            request.ssml
+            for request in plan_requests(SSMLTree.from_markup_string(ssmltext), max_bytes)
+        ]
+
+    audio_content = b""
+    for request in requests:
+        if limiter is not None:
+            limiter.acquire(len(request))
+        audio_content += backend.synthesize(request, lang, voice=voice)
 
     # The response's audio_content is binary.
-    with open("output.mp3", "wb") as out:
+    with open(filename, "wb") as out:
         # Write the response to the output file.
-        out.write(response.audio_content)
-        print('Audio content written to file "output.mp3"')
+        out.write(audio_content)
+        print(f'Audio content written to file "{filename}"')
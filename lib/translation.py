@@ -0,0 +1,225 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+import threading
+
+from lib.parser import SSMLEncloseTag, Text
+
+
+"""
+Translation stage: translates the Text payloads of a SSML tree in place.
+
+Rolling auto-captions repeat the same strings a lot, so texts are
+deduplicated first, looked up in a translation memory (in-memory LRU backed
+by an optional SQLite file), and only the misses are packed into size
+bounded batches sent concurrently to the translator.
+"""
+
+DEFAULT_BATCH_CHARS = 5000
+DEFAULT_BATCH_SIZE = 128
+
+
+class TranslationMemory(object):
+    def __init__(self, path=None, size=10000) -> None:
+        self.size = size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "source TEXT NOT NULL, target TEXT NOT NULL, text TEXT NOT NULL, "
+                "translation TEXT NOT NULL, PRIMARY KEY (source, target, text))"
+            )
+            self.connection.commit()
+
+    def _remember(self, key, translation):
+        self._cache[key] = translation
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.size:
+            self._cache.popitem(last=False)
+
+    def get_many(self, texts, target, source=None):
+        """Returns the known translations of `texts` as a dict."""
+        source = source or ""
+        found = {}
+        missing = []
+        with self._lock:
+            for text in texts:
+                key = (source, target, text)
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    found[text] = self._cache[key]
+                else:
+                    missing.append(text)
+            if self.connection is not None:
+                for text in missing:
+                    row = self.connection.execute(
+                        "SELECT translation FROM translations "
+                        "WHERE source = ? AND target = ? AND text = ?",
+                        (source, target, text),
+                    ).fetchone()
+                    if row is not None:
+                        found[text] = row[0]
+                        self._remember((source, target, text), row[0])
+        return found
+
+    def put_many(self, translations, target, source=None):
+        source = source or ""
+        with self._lock:
+            for text, translation in translations.items():
+                self._remember((source, target, text), translation)
+            if self.connection is not None:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+                    [
+                        (source, target, text, translation)
+                        for text, translation in translations.items()
+                    ],
+                )
+                self.connection.commit()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+class TranslationStats(object):
+    def __init__(self) -> None:
+        self.texts = 0
+        self.unique_texts = 0
+        self.characters = 0
+        self.deduplicated_characters = 0
+        self.cached_characters = 0
+        self.translated_characters = 0
+        self.batches = 0
+
+    @property
+    def saved_characters(self):
+        return self.deduplicated_characters + self.cached_characters
+
+    def to_dict(self):
+        return dict(vars(self), saved_characters=self.saved_characters)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.texts} texts ({self.unique_texts} unique), "
+            f"{self.characters} chars: {self.deduplicated_characters} saved by dedupe, "
+            f"{self.cached_characters} by the translation memory, "
+            f"{self.translated_characters} sent in {self.batches} batches"
+        )
+
+
+def collect_text_nodes(start_node):
+    """Text nodes below `start_node` in document order."""
+    nodes = []
+    traverse_stack = [start_node]
+    while len(traverse_stack) != 0:
+        node = traverse_stack.pop()
+        if isinstance(node, Text):
+            nodes.append(node)
+        elif isinstance(node, SSMLEncloseTag):
+            traverse_stack.extend(reversed(node.get_children()))
+    return nodes
+
+
+def pack_batches(texts, max_chars=DEFAULT_BATCH_CHARS, max_size=DEFAULT_BATCH_SIZE):
+    batches = []
+    batch = []
+    batch_chars = 0
+    for text in texts:
+        if batch and (batch_chars + len(text) > max_chars or len(batch) >= max_size):
+            batches.append(batch)
+            batch = []
+            batch_chars = 0
+        batch.append(text)
+        batch_chars += len(text)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def translate_texts(
+    texts,
+    target,
+    translator,
+    source=None,
+    memory=None,
+    max_batch_chars=DEFAULT_BATCH_CHARS,
+    max_batch_size=DEFAULT_BATCH_SIZE,
+    concurrency=4,
+):
+    """Translates `texts`, returns `(translations, stats)` where
+    `translations` maps every distinct non blank text to its translation."""
+    stats = TranslationStats()
+    unique_texts = {}
+    for text in texts:
+        stats.texts += 1
+        stats.characters += len(text)
+        if text.strip() == "":
+            continue
+        if text in unique_texts:
+            stats.deduplicated_characters += len(text)
+        unique_texts[text] = None
+    stats.unique_texts = len(unique_texts)
+
+    translations = {}
+    if memory is not None:
+        translations = memory.get_many(unique_texts, target, source)
+        stats.cached_characters = sum(len(text) for text in translations)
+
+    missing = [text for text in unique_texts if text not in translations]
+    batches = pack_batches(missing, max_batch_chars, max_batch_size)
+    stats.batches = len(batches)
+    stats.translated_characters = sum(len(text) for text in missing)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = executor.map(
+            lambda batch: translator.translate_batch(batch, target, source), batches
+        )
+        for batch, translated in zip(batches, results):
+            if len(translated) != len(batch):
+                raise ValueError(
+                    f"translator returned {len(translated)} texts for a batch of {len(batch)}"
+                )
+            batch_translations = dict(zip(batch, translated))
+            if memory is not None:
+                memory.put_many(batch_translations, target, source)
+            translations.update(batch_translations)
+    return translations, stats
+
+
+def write_translations(nodes, translations):
+    """Replaces the text of every node of `nodes` that has a translation."""
+    for node in nodes:
+        translation = translations.get(str(node))
+        if translation is not None:
+            node.text = translation
+
+
+def translate_tree(
+    tree,
+    target,
+    translator,
+    source=None,
+    memory=None,
+    max_batch_chars=DEFAULT_BATCH_CHARS,
+    max_batch_size=DEFAULT_BATCH_SIZE,
+    concurrency=4,
+):
+    """Translates every Text node of `tree` (a SSMLTree or node) in place."""
+    start_node = tree.root if hasattr(tree, "root") else tree
+    nodes = collect_text_nodes(start_node)
+    translations, stats = translate_texts(
+        [str(node) for node in nodes],
+        target,
+        translator,
+        source,
+        memory,
+        max_batch_chars,
+        max_batch_size,
+        concurrency,
+    )
+    write_translations(nodes, translations)
+    return stats
@@ -1,13 +1,27 @@
-import webvtt
-
+from lib.backends import get_caption_reader
+from lib.captions import collapse_captions_to_ssml
 from lib.parser import Break, Prosody, SSMLTree, S, Text
 
 from utils.helpers import format_vtt_timestamp_to_ms
 
 
-def convert_vtt_to_ssml(vttfile: str):
+def convert_vtt_to_ssml(vttfile: str, reader=None, collapse=False):
+    if reader is None:
+        reader = get_caption_reader()
+    if collapse:
+        return collapse_captions_to_ssml(reader.read(vttfile))
+    return convert_captions_to_ssml(reader.read(vttfile))
+
+
+def convert_vtt_text_to_ssml(vtt_text: str, reader=None, collapse=False):
+    if reader is None:
+        reader = get_caption_reader()
+    if collapse:
+        return collapse_captions_to_ssml(reader.read_text(vtt_text))
+    return convert_captions_to_ssml(reader.read_text(vtt_text))
+
 
-    vtt_reader = webvtt.read(vttfile)
+def convert_captions_to_ssml(vtt_reader):
     ssml_tree = SSMLTree()
     root = ssml_tree.root
     prev_text = ""
@@ -42,12 +56,12 @@ def convert_vtt_to_ssml(vttfile: str):
                 node = Break(time=f'{duration}ms')
             else:
                 node = S()
-                node.add_child(Prosody(duration=f'{duration}ms')).add_child(Text(curr_text))
+                node.add_child(Prosody(duration=f'{duration}ms'), trusted=True).add_child(Text(curr_text), trusted=True)
             # create_or_update_break = True
             # break_duration = starttime_ms - format_vtt_timestamp_to_ms(caption_line.start)
         else:
             node = S()
-            node.add_child(Prosody(duration=f'{duration}ms', rate='fast')).add_child(Text(curr_text))
+            node.add_child(Prosody(duration=f'{duration}ms', rate='fast'), trusted=True).add_child(Text(curr_text), trusted=True)
         
         if create_or_update_break:
             if prev_node is not None and isinstance(prev_node, Break):
@@ -55,10 +69,10 @@ def convert_vtt_to_ssml(vttfile: str):
                 prev_node.time = f'{new_duration}ms'
             else:
                 break_node = Break(time=f'{break_duration}ms')
-                root.add_child(break_node)
+                root.add_child(break_node, trusted=True)
                 prev_node = break_node
         prev_text = curr_text
         if node is not None:
-            root.add_child(node)
+            root.add_child(node, trusted=True)
             prev_node = node
     return ssml_tree
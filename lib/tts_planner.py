@@ -0,0 +1,259 @@
+import threading
+import time
+
+from lib.parser import SSMLEncloseTag, SSMLTree, Text
+from utils.helpers import parse_duration_to_ms
+
+
+"""
+Request planning for the text to speech backends.
+
+Google rejects requests over 5000 bytes of SSML and bills (and rate limits)
+every character of it, tags included. The planner walks a SSML tree, cuts it
+into segments (the top level S/Break subtrees, larger subtrees are split
+into their children under copies of their tags) sized from the cached
+`markup_size` of the nodes, and packs them in order into the fewest
+requests under the limits. The `duration` of a split Prosody is shared out
+between its copies in proportion to their text. `TokenBucket` paces the
+requests against a per minute character quota.
+"""
+
+GOOGLE_MAX_REQUEST_BYTES = 5000
+
+
+class Segment(object):
+    __slots__ = ("markup", "characters", "bytes")
+
+    def __init__(self, markup, characters, bytes) -> None:
+        self.markup = markup
+        self.characters = characters
+        self.bytes = bytes
+
+    @classmethod
+    def from_markup(cls, markup):
+        return cls(markup, len(markup), byte_size(markup))
+
+
+class SynthesisRequest(object):
+    """A SSML document to send in one request, with its billable size."""
+
+    __slots__ = ("ssml", "characters", "bytes")
+
+    def __init__(self, ssml, characters, bytes) -> None:
+        self.ssml = ssml
+        self.characters = characters
+        self.bytes = bytes
+
+    def __str__(self) -> str:
+        return self.ssml
+
+
+def byte_size(markup):
+    return len(markup) if markup.isascii() else len(markup.encode())
+
+
+def fits(characters, bytes, max_characters=None, max_bytes=None):
+    return (max_characters is None or characters <= max_characters) and (
+        max_bytes is None or bytes <= max_bytes
+    )
+
+
+def split_text(text, max_characters=None, max_bytes=None):
+    """Splits `text` after spaces into pieces within the limits, the pieces
+    add up to `text`."""
+    words = text.split(" ")
+    words = [Segment.from_markup(word + " ") for word in words[:-1]] + [
+        Segment.from_markup(words[-1])
+    ]
+    for word in words:
+        if not fits(word.characters, word.bytes, max_characters, max_bytes):
+            raise ValueError(f"The word {word.markup[:20]!r} doesn't fit in a request")
+    return [
+        Segment(
+            "".join(word.markup for word in group),
+            sum(word.characters for word in group),
+            sum(word.bytes for word in group),
+        )
+        for group in pack_segments(words, max_characters, max_bytes)
+    ]
+
+
+def share_duration(duration_ms, weights):
+    """Splits `duration_ms` in proportion to `weights`, the shares are whole
+    milliseconds adding up to `duration_ms`."""
+    total = sum(weights)
+    if total == 0:
+        weights = [1] * len(weights)
+        total = len(weights)
+    shares = []
+    done = 0
+    cumulative = 0
+    for weight in weights:
+        cumulative += weight
+        end = round(duration_ms * cumulative / total)
+        shares.append(end - done)
+        done = end
+    return shares
+
+
+def retimed_tags(node, duration_ms):
+    """`format_tags` of `node` with its duration set to `duration_ms`."""
+    piece = object.__new__(type(node))
+    piece.__dict__ = dict(node.__dict__)
+    piece.duration = f"{duration_ms}ms" if duration_ms else None
+    return piece.format_tags()
+
+
+def node_segments(node, max_characters=None, max_bytes=None):
+    """Segments of the children of `node`, each within the limits."""
+    segments = []
+    curr_node = node.child_ptr
+    while curr_node is not None:
+        characters, bytes = curr_node.markup_size()
+        if fits(characters, bytes, max_characters, max_bytes):
+            segments.append(Segment(str(curr_node), characters, bytes))
+        elif isinstance(curr_node, SSMLEncloseTag) and curr_node.child_ptr is not None:
+            duration_ms = parse_duration_to_ms(getattr(curr_node, "duration", None))
+            if duration_ms is None:
+                open_tag, close_tag = curr_node.format_tags()
+            else:
+                # no share is longer than the whole, so this reserves room for
+                # the tags of every piece
+                open_tag, close_tag = retimed_tags(curr_node, duration_ms)
+            tags = Segment.from_markup(open_tag + close_tag)
+            inner_chars = None if max_characters is None else max_characters - tags.characters
+            inner_bytes = None if max_bytes is None else max_bytes - tags.bytes
+            children = node_segments(curr_node, inner_chars, inner_bytes)
+            groups = pack_segments(children, inner_chars, inner_bytes)
+            if duration_ms is None:
+                group_tags = [(open_tag, close_tag)] * len(groups)
+            else:
+                shares = share_duration(
+                    duration_ms,
+                    [sum(segment.characters for segment in group) for group in groups],
+                )
+                group_tags = [retimed_tags(curr_node, share) for share in shares]
+            for group, (open_tag, close_tag) in zip(groups, group_tags):
+                tags = Segment.from_markup(open_tag + close_tag)
+                segments.append(
+                    Segment(
+                        open_tag + "".join(segment.markup for segment in group) + close_tag,
+                        tags.characters + sum(segment.characters for segment in group),
+                        tags.bytes + sum(segment.bytes for segment in group),
+                    )
+                )
+        elif isinstance(curr_node, Text):
+            segments.extend(split_text(str(curr_node), max_characters, max_bytes))
+        else:
+            raise ValueError(f"{curr_node} doesn't fit in a request")
+        curr_node = curr_node.next_node
+    return segments
+
+
+def pack_segments(segments, max_characters=None, max_bytes=None):
+    """Groups consecutive segments under the limits.
+
+    Filling every group before starting the next one gives the fewest groups
+    for an order preserving split, as segment sizes simply add up.
+    """
+    groups = []
+    group = []
+    characters = 0
+    bytes = 0
+    for segment in segments:
+        if group and not fits(
+            characters + segment.characters,
+            bytes + segment.bytes,
+            max_characters,
+            max_bytes,
+        ):
+            groups.append(group)
+            group = []
+            characters = bytes = 0
+        group.append(segment)
+        characters += segment.characters
+        bytes += segment.bytes
+    if group:
+        groups.append(group)
+    return groups
+
+
+def plan_requests(tree, max_bytes=GOOGLE_MAX_REQUEST_BYTES, max_characters=None):
+    """Splits `tree` (a SSMLTree or its root) into the fewest `<speak>`
+    documents of at most `max_bytes` UTF-8 bytes and `max_characters`
+    characters each, in document order."""
+    root = tree.root if isinstance(tree, SSMLTree) else tree
+    characters, bytes = root.markup_size()
+    if fits(characters, bytes, max_characters, max_bytes):
+        return [SynthesisRequest(str(root), characters, bytes)] if root.child_ptr else []
+
+    open_tag, close_tag = root.format_tags()
+    tags = Segment.from_markup(open_tag + close_tag)
+    if not fits(tags.characters + 1, tags.bytes + 1, max_characters, max_bytes):
+        raise ValueError(f"{open_tag} leaves no room for content")
+    segment_chars = None if max_characters is None else max_characters - tags.characters
+    segment_bytes = None if max_bytes is None else max_bytes - tags.bytes
+
+    requests = []
+    segments = node_segments(root, segment_chars, segment_bytes)
+    for group in pack_segments(segments, segment_chars, segment_bytes):
+        requests.append(
+            SynthesisRequest(
+                open_tag + "".join(segment.markup for segment in group) + close_tag,
+                tags.characters + sum(segment.characters for segment in group),
+                tags.bytes + sum(segment.bytes for segment in group),
+            )
+        )
+    return requests
+
+
+class TokenBucket(object):
+    """Token bucket refilled with `rate` tokens a second, up to `capacity`.
+
+    `reserve` takes the tokens right away and returns how long the caller
+    has to wait before using them; the bucket may go into debt, so callers
+    are served in order and the throughput stays at `rate` even for
+    requests larger than `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, tokens, capacity=None, clock=time.monotonic):
+        return cls(tokens / 60, capacity, clock)
+
+    def reserve(self, tokens):
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, tokens):
+        # asyncio is only imported here, the synthesis workers load this
+        # module and never use it
+        import asyncio
+
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
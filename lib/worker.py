@@ -0,0 +1,142 @@
+"""Batch worker backed by the durable job store.
+
+    python -m lib.worker --db jobs.sqlite submit <url> <lang> [--voice NAME]
+    python -m lib.worker --db jobs.sqlite run [--once] [--fake] [--translate]
+    python -m lib.worker --db jobs.sqlite status
+
+Any number of workers can share one database. A worker that dies leaves
+its job running until the lease expires; the next worker to claim it
+continues from the first incomplete stage.
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+import uuid
+
+from lib.backends import (
+    FakeSpeechBackend,
+    FakeVideoBackend,
+    StubTranslator,
+    get_speech_backend,
+    get_translator,
+    get_video_backend,
+)
+from lib.exceptions import LeaseLost
+from lib.job_store import JobStore
+from lib.pipeline import run_checkpointed_job
+from lib.translation import TranslationMemory
+from lib.tts_planner import TokenBucket
+
+
+def worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def run_worker(
+    store,
+    video_backend,
+    speech_backend,
+    caption_reader="webvtt",
+    once=False,
+    poll=2.0,
+    **pipeline_options,
+):
+    worker = worker_id()
+    while True:
+        job = store.claim(worker)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll)
+            continue
+        print(f"{worker}: running {job['id']} (attempt {job['attempts']})")
+        try:
+            chunks = run_checkpointed_job(
+                store,
+                job,
+                worker,
+                video_backend,
+                speech_backend,
+                caption_reader,
+                **pipeline_options,
+            )
+            print(f"{worker}: {job['id']} done, {len(chunks)} chunks")
+        except LeaseLost as ex:
+            print(f"{worker}: {ex}")
+        except Exception as ex:
+            print(f"{worker}: {job['id']} failed: {ex}")
+            try:
+                store.finish(job["id"], worker, status="failed", error=str(ex))
+            except LeaseLost:
+                pass
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--db", default="jobs.sqlite")
+    arg_parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="claims of a job whose lease keeps expiring before it is failed",
+    )
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit")
+    submit.add_argument("url")
+    submit.add_argument("lang")
+    submit.add_argument("--voice")
+    submit.add_argument("--tenant", default="default")
+
+    run = commands.add_parser("run")
+    run.add_argument("--once", action="store_true", help="exit when no job is left")
+    run.add_argument("--fake", action="store_true", help="use offline backends")
+    run.add_argument("--poll", type=float, default=2.0)
+    run.add_argument(
+        "--translate", action="store_true", help="translate the source subtitles"
+    )
+    run.add_argument("--source-lang", default="en")
+    run.add_argument("--translation-memory", help="SQLite file of the translation memory")
+    run.add_argument(
+        "--characters-per-minute",
+        type=int,
+        help="text to speech quota of this worker, requests are paced to stay under it",
+    )
+
+    commands.add_parser("status")
+    args = arg_parser.parse_args(argv)
+
+    store = JobStore(args.db, max_attempts=args.max_attempts)
+    if args.command == "submit":
+        print(store.create_job(args.url, args.lang, args.voice, args.tenant))
+    elif args.command == "run":
+        if args.fake:
+            backends = (FakeVideoBackend(), FakeSpeechBackend(), "basic")
+        else:
+            backends = (get_video_backend(), get_speech_backend(), "webvtt")
+        pipeline_options = {}
+        if args.translate:
+            pipeline_options = {
+                "translator": StubTranslator() if args.fake else get_translator(),
+                "source_lang": args.source_lang,
+                "memory": TranslationMemory(args.translation_memory),
+            }
+        if args.characters_per_minute:
+            pipeline_options["limiter"] = TokenBucket.per_minute(
+                args.characters_per_minute
+            )
+        run_worker(
+            store, *backends, once=args.once, poll=args.poll, **pipeline_options
+        )
+    else:
+        for job in store.list_jobs():
+            stages = ", ".join(sorted(store.completed_stages(job["id"]))) or "-"
+            print(f"{job['id']} {job['status']} {job['url']} [{stages}]")
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,50 +1,55 @@
 import os
 from typing import Dict, List
-from unittest import result
-import requests
-import urllib.request
-import yt_dlp
+
+from lib.backends import get_video_backend
 
 
 class YouTubeData(object):
 
-    def __init__(self, url) -> None:
+    subtitle_options = {
+        "writeautomaticsub": True,
+        'writeinfojson': True,
+        'writeannotations': True,
+        'subtitleslangs': ['en', 'fr', 'ar'],
+        'subtitlesformat': 'ttml'
+        }
+
+    def __init__(self, url, backend=None, info=None) -> None:
         self.url = url
-        with yt_dlp.YoutubeDL() as ydl:
-            download = ydl.extract_info(self.url, download=False)
+        self.backend = backend if backend is not None else get_video_backend()
+        download = info if info is not None else self.backend.extract_info(self.url)
         self.title = download['title']
         self.video_id = download['id']
 
     def list_all_subtitles(self) -> Dict[str, List[Dict]]:
         results = {}
-        ydl_opts = {
-            "writeautomaticsub": True, 
-            'writeinfojson': True,
-            'writeannotations': True, 
-            'subtitleslangs': ['en', 'fr', 'ar'],
-            'subtitlesformat': 'ttml'
-            }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            meta = ydl.extract_info(self.url, download=False) 
-            results = meta['automatic_captions']
+        meta = self.backend.extract_info(self.url, self.subtitle_options)
+        results = meta['automatic_captions']
         subs = meta.get('subtitles')
         if subs is not None:
             for lang in subs:
                 results[lang] = subs[lang]
         return results
 
+    def find_subtitle(self, lang, format):
+        """Returns the url of the `lang` subtitles and whether they are
+        automatic captions; manually written subtitles are preferred."""
+        meta = self.backend.extract_info(self.url, self.subtitle_options)
+        tracks = [
+            (meta.get('subtitles') or {}, False),
+            (meta.get('automatic_captions') or {}, True),
+        ]
+        for subs, automatic in tracks:
+            for sub in subs.get(lang, []):
+                if sub.get('ext') == format:
+                    return sub.get('url'), automatic
+        return None, False
+
     def get_subtitle(self, lang, format, save_to_file=False, filename=None):
-        all_subs = self.list_all_subtitles()
-        lang_subs = all_subs.get(lang, [])
-        sub_url = None
-        for sub in lang_subs:
-            if sub.get('ext') == format:
-                sub_url = sub.get('url')
-                break
+        sub_url, _ = self.find_subtitle(lang, format)
         if sub_url is None:
             return None
-        response = requests.get(sub_url)
-        data = response.text
+        data = self.backend.fetch_text(sub_url)
         if not filename:
             filename = f'{self.title}-{self.video_id}.{format}'
         if save_to_file:
@@ -60,9 +65,7 @@ class YouTubeData(object):
         if os.path.exists(filename):
             return filename
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            download = ydl.extract_info(self.url, download=False)
-        
-        urllib.request.urlretrieve(download['url'], filename)
-        return filename
+        download = self.backend.extract_info(self.url, ydl_opts)
+
+        return self.backend.download(download['url'], filename)
          
@@ -0,0 +1,161 @@
+import pytest
+
+from lib.arena import ArenaTree
+from lib.parser import Break, Prosody, S, SSMLTree, Text
+
+
+DOCUMENT = (
+    '<speak xml:lang="en" xml:id="root">'
+    '<s><prosody duration="1200ms">hello there</prosody><break time="300ms" /></s>'
+    '<s>how are you<break time="1s" /><break strength="weak" /></s>'
+    '<p><s><prosody duration="250ms">fine</prosody></s></p>'
+    "</speak>"
+)
+
+
+def parsed_arena(document=DOCUMENT):
+    arena = ArenaTree(id="root", lang="en")
+    arena.parse_fragment(document[document.index(">") + 1 : document.rindex("<")])
+    return arena
+
+
+def tags(nodes):
+    return [node.tag for node in nodes]
+
+
+def test_parsed_arena_prints_like_the_parsed_tree():
+    assert str(parsed_arena()) == str(SSMLTree.parse(DOCUMENT))
+
+
+def test_tree_round_trip():
+    tree = SSMLTree.from_markup_string(DOCUMENT)
+    arena = ArenaTree.from_tree(tree)
+
+    assert str(arena) == str(tree)
+    assert str(arena.to_tree()) == str(tree)
+    assert arena.to_tree().validate() == []
+
+
+def test_duration_columns():
+    arena = parsed_arena()
+
+    assert list(arena.durations("break")) == [300, 1000]
+    assert arena.total_duration() == 1300
+    assert arena.total_duration("prosody") == 1450
+    assert arena.duration_histogram("prosody", bin_ms=500) == {0: 1, 1000: 1}
+
+
+def test_attribute_changes_update_the_duration_column():
+    arena = parsed_arena()
+    first_break = arena.find("break")
+
+    first_break.time = "2s"
+
+    assert first_break.time == "2s"
+    assert arena.total_duration() == 3000
+
+
+def test_select_count_and_char_counts():
+    arena = parsed_arena()
+
+    assert arena.count("s") == 3
+    assert [arena.view(index).tag for index in arena.select("s")] == ["s"] * 3
+    assert list(arena.char_counts("s")) == [11, 11, 4]
+    assert list(arena.char_counts("p")) == [4]
+    assert arena.subtree_char_counts()[arena.root.index] == 26
+
+
+def test_char_counts_of_nodes_linked_out_of_order():
+    arena = ArenaTree()
+    text = arena.new_node(Text, text="early")
+    sentence = arena.new_node(S)
+    arena.link_child(sentence, text)
+    arena.link_child(arena.root.index, sentence)
+
+    assert not arena.ordered
+    assert list(arena.char_counts("s")) == [5]
+    assert arena.subtree_char_counts()[arena.root.index] == 5
+
+
+def test_unknown_tags_match_nothing():
+    arena = parsed_arena()
+
+    assert arena.find("bogus") is None
+    assert arena.find_all("bogus") == []
+    assert list(arena.select("bogus")) == []
+    assert arena.count("bogus") == 0
+    assert list(arena.durations("bogus")) == []
+    assert list(arena.char_counts("bogus")) == []
+
+
+def test_find_and_find_all_match_the_object_tree():
+    arena = parsed_arena()
+    tree = SSMLTree.from_markup_string(DOCUMENT)
+
+    for tag in ["s", "break", "prosody", "p", "speak"]:
+        assert [str(node) for node in arena.find_all(tag)] == [
+            str(node) for node in tree.find_all(tag)
+        ]
+        assert str(arena.find(tag)) == str(tree.find(tag))
+    assert arena.find("prosody").parent_node.tag == "s"
+    assert tags(arena.root.get_children()) == tags(
+        [arena.view(index) for index in arena.children(arena.root.index)]
+    )
+
+
+def test_add_child_matches_the_object_tree():
+    arena = ArenaTree()
+    tree = SSMLTree()
+
+    for target in [arena, tree]:
+        sentence = target.add_child(S())
+        sentence.add_child(Prosody(duration="500ms")).add_child(Text("hi"))
+        sentence.add_child(Break(time="200ms"))
+
+    assert str(arena) == str(tree)
+    assert arena.total_duration() == 200
+
+
+def test_add_child_validates_unless_trusted():
+    arena = ArenaTree()
+    prosody = arena.add_child(Prosody())
+
+    with pytest.raises(ValueError):
+        prosody.add_child(S())
+    with pytest.raises(ValueError):
+        arena.find("prosody").add_child(prosody)
+    with pytest.raises(ValueError):
+        arena.add_child(prosody)
+    with pytest.raises(ValueError):
+        arena.add_child("text")
+
+    prosody.add_child(S(), trusted=True)
+    assert arena.count("s") == 1
+
+
+def test_views_only_expose_node_attributes():
+    arena = parsed_arena()
+    sentence = arena.find("s")
+    text = sentence.child_ptr.child_ptr
+
+    assert sentence.id is None
+    assert not hasattr(sentence, "anything")
+    with pytest.raises(AttributeError):
+        sentence.get_chlidren()
+    with pytest.raises(AttributeError):
+        sentence.anything = 1
+    with pytest.raises(AttributeError):
+        text.time
+
+
+def test_text_views_read_and_write_the_text():
+    arena = parsed_arena()
+    text = arena.find("s").child_ptr.child_ptr
+
+    assert text.text == "hello there"
+    text.text = "bye"
+
+    assert "<prosody duration=\"1200ms\">bye</prosody>" in str(arena)
+    assert list(arena.char_counts("s")) == [3, 11, 4]
+    with pytest.raises(TypeError):
+        text.text = 3
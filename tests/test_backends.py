@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+from lib.backends import ClientPool
+
+
+def test_client_pool_reuses_clients_up_to_its_size():
+    created = []
+    pool = ClientPool(lambda: created.append(object()) or created[-1], size=2)
+
+    with pool.acquire() as first:
+        with pool.acquire() as second:
+            assert first is not second
+    with pool.acquire() as third:
+        assert third in (first, second)
+    assert len(created) == 2
+
+
+def test_client_pool_gives_the_slot_back_when_the_factory_fails():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) <= 3:
+            raise ConnectionError("no client")
+        return object()
+
+    pool = ClientPool(factory, size=1)
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            with pool.acquire():
+                pass
+
+    acquired = []
+
+    def acquire():
+        with pool.acquire() as client:
+            acquired.append(client)
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive() and len(acquired) == 1
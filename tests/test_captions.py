@@ -0,0 +1,89 @@
+import os
+import re
+
+from lib.backends import BasicVTTCaptionReader, FakeVideoBackend
+from lib.captions import CollapseStats, collapse_captions_to_ssml
+from lib.pipeline import fetch_subtitles
+from lib.transpiler import convert_captions_to_ssml
+from lib.translation import collect_text_nodes
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+AUTO_CAPTIONS_SENTENCES = [
+    "hi everyone and welcome back to the channel today we're going to look at how "
+    "sourdough starter actually works and why it sometimes fails so the first thing "
+    "you need is flour and water that's really all there is to",
+    "it",
+    "now the second thing is time you have to feed it every day for about a week and "
+    "keep it somewhere warm like on top of the fridge once it doubles in size it's ready",
+]
+
+
+def read_captions(text):
+    return BasicVTTCaptionReader().read_text(text)
+
+
+def sentences(tree):
+    return [str(node) for node in collect_text_nodes(tree.root)]
+
+
+def durations(tree):
+    return [int(value) for value in re.findall(r'duration="(\d+)ms"', str(tree))]
+
+
+def test_auto_captions_fixture_collapses_to_the_spoken_text():
+    captions = BasicVTTCaptionReader().read(os.path.join(FIXTURES, "auto_captions_en.vtt"))
+    stats = CollapseStats()
+    collapsed = collapse_captions_to_ssml(captions, stats=stats)
+    legacy = convert_captions_to_ssml(captions)
+
+    assert sentences(collapsed) == AUTO_CAPTIONS_SENTENCES
+    assert (stats.cue_words, stats.emitted_words) == (220, 76)
+    # every line is on screen three times in the cue text
+    assert (stats.cue_characters, stats.characters) == (1090, 378)
+    # the text matches the legacy transpiler, the SSML billed is 42% smaller
+    assert " ".join(sentences(legacy)).split() == " ".join(sentences(collapsed)).split()
+    assert (len(str(legacy)), len(str(collapsed))) == (1035, 600)
+    assert all(duration > 0 for duration in durations(collapsed))
+
+
+def test_overlap_of_a_single_word_is_kept():
+    captions = read_captions(
+        "WEBVTT\n\n"
+        "00:00:01.000 --> 00:00:03.000\nDid you say no?\n\n"
+        "00:00:03.000 --> 00:00:05.000\nNo, I said yes.\n"
+    )
+    assert sentences(collapse_captions_to_ssml(captions)) == [
+        "Did you say no?",
+        "No, I said yes.",
+    ]
+
+
+def test_partial_overlap_of_several_words_is_dropped():
+    captions = read_captions(
+        "WEBVTT\n\n"
+        "00:00:01.000 --> 00:00:03.000\nso the first thing you need\n\n"
+        "00:00:03.000 --> 00:00:05.000\nthing you need is flour.\n"
+    )
+    assert sentences(collapse_captions_to_ssml(captions)) == [
+        "so the first thing you need is flour."
+    ]
+
+
+def test_sentences_ending_mid_cue_get_a_duration():
+    captions = read_captions(
+        "WEBVTT\n\n00:00:05.000 --> 00:00:08.000\nI think so. I think\n"
+    )
+    tree = collapse_captions_to_ssml(captions)
+    assert sentences(tree) == ["I think so.", "I think"]
+    assert durations(tree) == [1800, 1200]
+
+
+def test_only_automatic_captions_are_marked_for_collapse():
+    auto, _ = fetch_subtitles(FakeVideoBackend(), "https://example.com/v", "en")
+    manual, _ = fetch_subtitles(
+        FakeVideoBackend(manual_langs=["en"]), "https://example.com/v", "en"
+    )
+    assert auto["automatic"] is True
+    assert manual["automatic"] is False
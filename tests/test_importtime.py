@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from utils.importtime import (
+    STDLIB_ONLY_MODULES,
+    measure_import,
+    run_importtime,
+    third_party_modules,
+)
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def startup_modules():
+    return {name for name, _, _ in run_importtime("pass")}
+
+
+@pytest.mark.parametrize("module", STDLIB_ONLY_MODULES)
+def test_stdlib_only_modules_import_no_third_party_package(
+    module, startup_modules, monkeypatch
+):
+    monkeypatch.chdir(REPO_ROOT)
+    records = measure_import(module, startup_modules)
+
+    assert records[-1][0] == module
+    assert third_party_modules(records) == []
+
+
+def test_synthesis_skips_the_caption_modules(startup_modules, monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    loaded = {name for name, _, _ in measure_import("lib.text_to_speech", startup_modules)}
+
+    assert loaded.isdisjoint({"lib.transpiler", "lib.captions", "lib.youtube_data"})
+
+
+def test_third_party_modules_ignores_stdlib_and_project():
+    records = [
+        ("json", 1, 1),
+        ("lib.parser", 1, 1),
+        ("google.cloud", 1, 1),
+        ("google", 1, 1),
+        ("yt_dlp", 1, 1),
+    ]
+    assert third_party_modules(records) == ["google", "yt_dlp"]
+
+
+def test_tts_planner_leaves_asyncio_to_the_service(startup_modules, monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    for module in ["lib.tts_planner", "lib.text_to_speech"]:
+        loaded = {name for name, _, _ in measure_import(module, startup_modules)}
+        assert "asyncio" not in loaded
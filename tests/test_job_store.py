@@ -0,0 +1,155 @@
+import threading
+import time
+
+import pytest
+
+from lib.backends import FakeSpeechBackend, FakeVideoBackend
+from lib.exceptions import LeaseLost
+from lib.job_store import JobStore
+from lib.pipeline import run_checkpointed_job
+
+
+class FakeClock(object):
+    def __init__(self, now=1000.0) -> None:
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def wait_until(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class StealingLimiter(object):
+    """Hands the job to another worker while the first one waits."""
+
+    def __init__(self, store, job_id) -> None:
+        self.store = store
+        self.job_id = job_id
+
+    def acquire(self, tokens):
+        self.store.connection.execute(
+            "UPDATE jobs SET lease_expires = 0 WHERE id = ?", (self.job_id,)
+        )
+        assert self.store.claim("thief")["id"] == self.job_id
+
+
+def run_job(store, speech):
+    return run_checkpointed_job(
+        store,
+        store.claim("worker"),
+        "worker",
+        FakeVideoBackend(cues=400),
+        speech,
+        "basic",
+        chunk_chars=2000,
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"), lease_seconds=0.5)
+    yield store
+    store.close()
+
+
+def test_keep_lease_renews_the_lease_while_the_block_runs(tmp_path):
+    clock = FakeClock()
+    store = JobStore(str(tmp_path / "jobs.sqlite"), lease_seconds=10, clock=clock)
+    job_id = store.create_job("https://example.com/v", "en")
+    store.claim("worker")
+    with store.keep_lease(job_id, "worker", interval=0.01):
+        clock.now += 100
+        # the lease is renewed from the clock of the next heartbeat
+        wait_until(lambda: store.get_job(job_id)["lease_expires"] > clock.now)
+        assert store.claim("other") is None
+    clock.now += 100
+    assert store.claim("other")["id"] == job_id
+    store.close()
+
+
+def test_concurrent_claims_take_every_job_once(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    job_ids = [JobStore(path).create_job(f"https://example.com/{i}", "en") for i in range(40)]
+    stores = [JobStore(path) for _ in range(4)]
+    claimed = [[] for _ in stores]
+    start = threading.Barrier(len(stores))
+
+    def claim_all(store, jobs):
+        start.wait()
+        while True:
+            job = store.claim(f"worker-{id(jobs)}")
+            if job is None:
+                return
+            jobs.append(job["id"])
+
+    threads = [
+        threading.Thread(target=claim_all, args=(store, jobs))
+        for store, jobs in zip(stores, claimed)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for store in stores:
+        store.close()
+
+    every_claim = [job_id for jobs in claimed for job_id in jobs]
+    assert sorted(every_claim) == sorted(job_ids)
+
+
+def test_job_is_failed_after_max_attempts(tmp_path):
+    clock = FakeClock()
+    store = JobStore(
+        str(tmp_path / "jobs.sqlite"), lease_seconds=10, max_attempts=2, clock=clock
+    )
+    job_id = store.create_job("https://example.com/v", "en")
+    assert store.claim("first")["attempts"] == 1
+    clock.now += 11
+    assert store.claim("second")["attempts"] == 2
+    clock.now += 11
+
+    assert store.claim("third") is None
+    job = store.get_job(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "lease expired after 2 attempts"
+    store.close()
+
+
+def test_lost_lease_stops_the_job_before_a_paid_request(store):
+    job_id = store.create_job("https://example.com/v", "en")
+    job = store.claim("worker")
+    speech = FakeSpeechBackend()
+
+    with pytest.raises(LeaseLost):
+        run_checkpointed_job(
+            store,
+            job,
+            "worker",
+            FakeVideoBackend(),
+            speech,
+            "basic",
+            limiter=StealingLimiter(store, job_id),
+        )
+    assert speech.requests == 0
+
+
+def test_resumed_job_skips_synthesized_chunks(store):
+    job_id = store.create_job("https://example.com/v", "en")
+    speech = FakeSpeechBackend()
+    chunks = run_job(store, speech)
+    assert len(chunks) == speech.requests > 1
+
+    store.connection.execute(
+        "DELETE FROM artifacts WHERE job_id = ? AND name = ?", (job_id, "chunk-00001")
+    )
+    store.connection.execute(
+        "DELETE FROM stages WHERE job_id = ? AND stage = 'synthesis'", (job_id,)
+    )
+    store.connection.execute("UPDATE jobs SET status = 'pending' WHERE id = ?", (job_id,))
+    run_job(store, speech)
+    assert speech.requests == len(chunks) + 1
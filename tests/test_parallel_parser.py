@@ -0,0 +1,87 @@
+from concurrent.futures import ProcessPoolExecutor
+import random
+
+import pytest
+
+from lib.exceptions import InvalidSSMLSyntax
+from lib.parallel_parser import parse_parallel
+from lib.parser import NodeValidator, SSMLTree
+
+
+WORDS = ["hi ", "there, ", "it's ", "\n", "café "]
+TAGS = ["s", "p", "prosody", "par", "seq", "media", "audio"]
+ATTRIBUTES = ["", ' rate="fast"', ' id="x1"', ' foo="bar"', ' duration="1500ms"']
+
+
+def random_body(rng, depth=0):
+    parts = []
+    for _ in range(rng.randint(0, 5)):
+        roll = rng.random()
+        if roll < 0.3:
+            parts.append(rng.choice(WORDS))
+        elif roll < 0.5:
+            parts.append('<break time="%dms" />' % rng.randint(1, 900))
+        elif depth < 3:
+            tag = rng.choice(TAGS)
+            body = random_body(rng, depth + 1)
+            parts.append(f"<{tag}{rng.choice(ATTRIBUTES)}>{body}</{tag}>")
+    return "".join(parts)
+
+
+def validation(node):
+    return [str(violation) for violation in NodeValidator.validate(node)]
+
+
+@pytest.fixture(scope="module")
+def executor():
+    with ProcessPoolExecutor(2) as pool:
+        yield pool
+
+
+def test_parallel_parse_matches_serial_parse_on_random_documents(executor):
+    rng = random.Random(2)
+    for _ in range(100):
+        body = "".join(random_body(rng) for _ in range(10))
+        document = f'  <speak xml:lang="en">{body}</speak>\n'
+
+        parallel = parse_parallel(document, workers=2, executor=executor, min_chars=0)
+        serial = SSMLTree.parse(document)
+
+        assert str(parallel) == str(serial)
+        assert parallel.markup_size() == serial.markup_size()
+        assert validation(parallel) == validation(serial)
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        "<speak><s>x</speak>",
+        "<speak><s>a</s><s>b</s><s>c</s></s></speak>",
+        "<speak><s>a</s><s>b</s><bogus>c</bogus><s>d</s></speak>",
+    ],
+)
+def test_broken_documents_raise_like_the_serial_parser(executor, document):
+    with pytest.raises(InvalidSSMLSyntax):
+        SSMLTree.parse(document)
+    with pytest.raises(InvalidSSMLSyntax):
+        parse_parallel(document, workers=2, executor=executor, min_chars=0)
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        "<speak>" + "<s>a</s>" * 3 + "</speak></speak>",
+        "<speak><s>a</s><s>b < c</s><s>d</s><s>e</s></speak>",
+        '<speak><s>a</s><break time="1s"><s>b</s><s>c</s></speak>',
+    ],
+)
+def test_unusual_documents_parse_like_the_serial_parser(executor, document):
+    parallel = parse_parallel(document, workers=2, executor=executor, min_chars=0)
+
+    assert str(parallel) == str(SSMLTree.parse(document))
+
+
+def test_small_documents_are_parsed_serially():
+    document = "<speak><s>a</s><s>b</s></speak>"
+
+    assert str(parse_parallel(document, workers=2)) == str(SSMLTree.parse(document))
@@ -0,0 +1,155 @@
+import pytest
+
+from lib.exceptions import InvalidSSMLStructure, InvalidSSMLSyntax
+from lib.parser import (
+    ALLOWED_CHILDREN,
+    Audio,
+    Break,
+    Media,
+    NodeValidator,
+    P,
+    Par,
+    Prosody,
+    S,
+    Seq,
+    Speak,
+    SSMLTree,
+    Text,
+    resolve_allowed_children,
+)
+
+
+# documents the parser before the single pass rewrite handled correctly,
+# with the output it gave
+OLD_PARSER_OUTPUTS = [
+    (
+        '<speak><par><media>x<break time="2s" /></media><media>y</media></par>'
+        "<seq><media>z</media></seq></speak>",
+        '<speak><par><media>x<break time="2s" /></media><media>y</media></par>'
+        "<seq><media>z</media></seq></speak>",
+    ),
+    (
+        '<speak><par><media><break strength="weak" /></media></par></speak>',
+        '<speak><par><media><break strength="weak" /></media></par></speak>',
+    ),
+    (
+        '<speak xml:lang="en" xml:id="root"><prosody>b</prosody></speak>',
+        '<speak xml:lang="en" xml:id="root"><prosody>b</prosody></speak>',
+    ),
+]
+
+# documents the old parser rejected (attributes on nested tags), reordered
+# (inline tags after text) or dropped nodes of (repeated inline tags); they
+# now come back as written
+ROUND_TRIPS = [
+    '<speak xml:lang="en" xml:id="root">a<prosody>b</prosody><break time="1s" />c</speak>',
+    '<speak><prosody rate="fast" duration="1200ms">hello there</prosody>'
+    '<break time="300ms" /></speak>',
+    '<speak><prosody>one</prosody><break time="200ms" /><break time="200ms" />'
+    "<prosody>two</prosody></speak>",
+    '<speak><p><s>one<break time="1s" /></s><s><prosody pitch="high">two</prosody></s></p>'
+    '<audio src="a.mp3">three</audio></speak>',
+]
+
+
+@pytest.mark.parametrize("document, old_output", OLD_PARSER_OUTPUTS)
+def test_parse_matches_the_old_parser(document, old_output):
+    assert str(SSMLTree.parse(document)) == old_output
+
+
+@pytest.mark.parametrize("document", ROUND_TRIPS)
+def test_parse_round_trips(document):
+    assert str(SSMLTree.parse(document)) == document
+
+
+def test_parse_strips_newlines_around_text():
+    document = '<speak>first\n<break time="1s" />second\n</speak>'
+
+    assert str(SSMLTree.parse(document)) == '<speak>first<break time="1s" />second</speak>'
+
+
+@pytest.mark.parametrize(
+    "document",
+    ["<speak><s>x</speak>", "<speak><s>x</s>", "x<speak></speak>", "<speak><bogus /></speak>"],
+)
+def test_parse_rejects_broken_documents(document):
+    with pytest.raises(InvalidSSMLSyntax):
+        SSMLTree.parse(document)
+
+
+def test_string_entries_resolve_to_tag_classes():
+    assert ALLOWED_CHILDREN[Seq] == frozenset({Seq, Par, Media})
+    assert ALLOWED_CHILDREN[Par] == frozenset({Seq, Par, Media})
+    assert ALLOWED_CHILDREN[Media] == frozenset({Speak, Audio})
+    assert ALLOWED_CHILDREN[Speak] is None
+    assert resolve_allowed_children(S) == frozenset({Prosody, Text, Break, Par, Seq})
+
+
+def test_validate_reports_every_violation_with_its_path():
+    tree = SSMLTree.from_markup_string(
+        "<speak><prosody><s>a</s><s>b</s></prosody><p>c<s>d</s></p>"
+        "<seq><media><break /></media></seq></speak>"
+    )
+
+    violations = [str(violation) for violation in tree.validate()]
+
+    assert violations == [
+        "speak/prosody[0]/s[0]: S is not a valid child for Prosody",
+        "speak/prosody[0]/s[1]: S is not a valid child for Prosody",
+        "speak/p[1]/text[0]: Text is not a valid child for P",
+        "speak/seq[2]/media[0]/break[0]: Break is not a valid child for Media",
+    ]
+    with pytest.raises(InvalidSSMLStructure):
+        tree.validate(raise_error=True)
+
+
+def test_validate_accepts_a_valid_parsed_tree():
+    tree = SSMLTree.from_markup_string(ROUND_TRIPS[-1])
+
+    assert tree.validate() == []
+
+
+def test_validate_detects_cycles_and_duplicated_children():
+    sentence = S()
+    text = sentence.add_child(Text("a"))
+    sentence.add_child(Break(time="1s"))
+    # the second break's next pointer leads back to the text
+    sentence._last_child.next_node = text
+
+    messages = [violation.message for violation in NodeValidator.validate(sentence)]
+
+    assert "node appears more than once in the tree" in messages
+
+
+def test_validate_detects_broken_links():
+    sentence = S()
+    first = sentence.add_child(Text("a"))
+    second = sentence.add_child(Text("b"))
+    second.prev_node = None
+    first.parent_node = P()
+
+    violations = NodeValidator.validate(sentence)
+
+    assert [(violation.path, violation.message) for violation in violations] == [
+        ("s/text[0]", "parent_node doesn't point to its parent"),
+        ("s/text[1]", "prev_node doesn't point to the previous sibling"),
+    ]
+
+
+def test_add_child_checks_unless_trusted():
+    prosody = Prosody()
+    with pytest.raises(ValueError):
+        prosody.add_child(S())
+    with pytest.raises(ValueError):
+        prosody.add_child(prosody)
+    text = prosody.add_child(Text("a"))
+    with pytest.raises(ValueError):
+        prosody.add_child(text)
+
+    sentence = prosody.add_child(S(), trusted=True)
+
+    assert prosody.get_children() == [text, sentence]
+    assert sentence.parent_node is prosody and sentence.prev_node is text
+    assert [str(violation) for violation in NodeValidator.validate(prosody)] == [
+        "prosody/s[1]: S is not a valid child for Prosody"
+    ]
@@ -0,0 +1,193 @@
+import asyncio
+import json
+
+from lib.backends import FakeSpeechBackend, FakeVideoBackend
+from lib.service import TranslationService
+
+
+def make_service(speech_backend=None, **options):
+    options.setdefault("workers", 2)
+    return TranslationService(
+        speech_backend or FakeSpeechBackend(), FakeVideoBackend(cues=5), "basic", **options
+    )
+
+
+async def http_request(port, method, path, payload=None):
+    body = b"" if payload is None else json.dumps(payload).encode()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, body = response.split(b"\r\n\r\n", 1)
+    status_line, *header_lines = head.decode().split("\r\n")
+    headers = dict(line.split(": ", 1) for line in header_lines)
+    return int(status_line.split(" ")[1]), headers, json.loads(body)
+
+
+async def run_jobs(service, count):
+    jobs = [await service.submit(f"https://example.com/{i}", "en") for i in range(count)]
+    for job in jobs:
+        async with job.changed:
+            await job.changed.wait_for(lambda: job.finished)
+    return jobs
+
+
+def test_finished_jobs_are_evicted_above_the_cap_and_after_the_ttl():
+    async def scenario():
+        service = make_service(max_finished_jobs=2, finished_ttl=60)
+        await service.start()
+        try:
+            jobs = await run_jobs(service, 3)
+            assert all(job.status == "done" for job in jobs)
+            by_finish = sorted(jobs, key=lambda job: job.finished_at)
+            assert set(service.jobs) == {job.id for job in by_finish[1:]}
+
+            service.evict_finished(now=by_finish[-1].finished_at + 61)
+            assert service.jobs == {}
+        finally:
+            await service.stop()
+
+    asyncio.run(scenario())
+
+
+def test_streamed_audio_is_released():
+    async def scenario():
+        service = make_service()
+        await service.start()
+        try:
+            (job,) = await run_jobs(service, 1)
+            first = [event async for event in service.stream_events(job)]
+            second = [event async for event in service.stream_events(job)]
+        finally:
+            await service.stop()
+        audio = [event for event in first if event["event"] == "audio"]
+        assert audio and all("audio" in event for event in audio)
+        assert job.results == [None] * job.chunks
+        assert job.to_dict()["chunks"] == len(audio)
+        assert all(event.get("released") for event in second if event["event"] == "audio")
+
+    asyncio.run(scenario())
+
+
+def test_large_bodies_are_rejected_with_413():
+    async def scenario():
+        service = make_service(max_body_bytes=1024)
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"POST /jobs HTTP/1.1\r\nContent-Length: 1000000000\r\n\r\n")
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+        return response
+
+    response = asyncio.run(scenario())
+    head, body = response.split(b"\r\n\r\n", 1)
+    assert head.startswith(b"HTTP/1.1 413 ")
+    assert "1024" in json.loads(body)["error"]
+
+
+def test_full_queue_answers_429_with_retry_after():
+    async def scenario():
+        # not started, so every accepted job stays queued
+        service = make_service(queue_size=3)
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return [
+                await http_request(port, "POST", "/jobs", {"url": f"u{i}", "lang": "en"})
+                for i in range(5)
+            ], len(service.pending)
+
+    responses, queued = asyncio.run(scenario())
+    assert [status for status, _, _ in responses] == [202, 202, 202, 429, 429]
+    assert all(headers["Retry-After"] == "1" for _, headers, _ in responses[3:])
+    assert queued == 3
+
+
+def test_tenant_concurrency_is_enforced():
+    async def scenario():
+        service = make_service(
+            FakeSpeechBackend(latency=0.02), workers=4, tenant_concurrency=1
+        )
+        running = {"a": 0, "b": 0}
+        peaks = {"a": 0, "b": 0, "total": 0}
+        run_job = service.run_job
+
+        async def tracked_run_job(job):
+            running[job.tenant] += 1
+            peaks[job.tenant] = max(peaks[job.tenant], running[job.tenant])
+            peaks["total"] = max(peaks["total"], sum(running.values()))
+            try:
+                await run_job(job)
+            finally:
+                running[job.tenant] -= 1
+
+        service.run_job = tracked_run_job
+        await service.start()
+        try:
+            jobs = [
+                await service.submit(f"https://example.com/{i}", "en", tenant=tenant)
+                for i, tenant in enumerate("aaabb")
+            ]
+            for job in jobs:
+                async with job.changed:
+                    await job.changed.wait_for(lambda: job.finished)
+        finally:
+            await service.stop()
+        return jobs, peaks
+
+    jobs, peaks = asyncio.run(scenario())
+    assert all(job.status == "done" for job in jobs)
+    assert peaks == {"a": 1, "b": 1, "total": 2}
+
+
+def test_fields_that_are_not_strings_are_rejected_and_workers_keep_running():
+    async def scenario():
+        service = make_service(workers=1)
+        failed_once = []
+        run_job = service.run_job
+
+        async def flaky_run_job(job):
+            if not failed_once:
+                failed_once.append(job)
+                raise RuntimeError("bug in the job")
+            await run_job(job)
+
+        service.run_job = flaky_run_job
+        await service.start()
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            async with server:
+                bad = [
+                    await http_request(port, "POST", "/jobs", payload)
+                    for payload in [
+                        {"url": "u", "lang": "en", "tenant": ["x"]},
+                        {"url": ["u"], "lang": "en"},
+                        {"url": "u", "lang": 1},
+                        {"url": "u", "lang": "en", "voice": {}},
+                    ]
+                ]
+                first = await service.submit("https://example.com/1", "en")
+                status, _, job = await http_request(
+                    port, "POST", "/jobs", {"url": "https://example.com/2", "lang": "en"}
+                )
+                second = service.jobs[job["id"]]
+                for job in (first, second):
+                    async with job.changed:
+                        await job.changed.wait_for(lambda: job.finished)
+        finally:
+            await service.stop()
+        return bad, status, first, second
+
+    bad, status, first, second = asyncio.run(scenario())
+    assert [status for status, _, _ in bad] == [400] * 4
+    assert "tenant" in bad[0][2]["error"]
+    assert status == 202
+    assert (first.status, first.error) == ("failed", "bug in the job")
+    assert second.status == "done"
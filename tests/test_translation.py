@@ -0,0 +1,83 @@
+from lib.backends import StubTranslator
+from lib.parser import S, SSMLTree, Text
+from lib.pipeline import apply_translations, ssml_texts, translate_ssml
+from lib.translation import (
+    TranslationMemory,
+    collect_text_nodes,
+    pack_batches,
+    translate_tree,
+)
+
+
+TEXTS = ["hello there", "how are you", "hello there", "fine", "how are you", "bye"]
+
+
+def make_tree(texts=TEXTS):
+    tree = SSMLTree()
+    for text in texts:
+        tree.add_child(S()).add_child(Text(text))
+    return tree
+
+
+def tree_texts(tree):
+    return [str(node) for node in collect_text_nodes(tree.root)]
+
+
+def test_identical_texts_are_translated_once():
+    translator = StubTranslator()
+    stats = translate_tree(make_tree(), "de", translator)
+
+    assert stats.texts == 6
+    assert stats.unique_texts == 4
+    assert stats.characters == sum(len(text) for text in TEXTS)
+    assert stats.deduplicated_characters == len("hello there") + len("how are you")
+    assert translator.characters == stats.translated_characters == len(
+        "hello therehow are youfinebye"
+    )
+
+
+def test_translations_are_written_back_in_document_order():
+    tree = make_tree()
+    translate_tree(tree, "de", StubTranslator(), max_batch_size=1, concurrency=4)
+    assert tree_texts(tree) == [f"[de] {text}" for text in TEXTS]
+
+
+def test_translation_memory_serves_the_second_run(tmp_path):
+    path = str(tmp_path / "memory.sqlite")
+    first = StubTranslator()
+    translate_tree(make_tree(), "de", first, source="en", memory=TranslationMemory(path))
+
+    # a new memory instance only has the SQLite file to go on
+    second = StubTranslator()
+    tree = make_tree()
+    stats = translate_tree(tree, "de", second, source="en", memory=TranslationMemory(path))
+
+    assert stats.cached_characters == first.characters
+    assert stats.translated_characters == 0
+    assert second.batches == 0
+    assert tree_texts(tree) == [f"[de] {text}" for text in TEXTS]
+
+
+def test_batches_respect_the_size_and_character_limits():
+    texts = [f"text number {i}" for i in range(50)]
+    batches = pack_batches(texts, max_chars=60, max_size=3)
+
+    assert [text for batch in batches for text in batch] == texts
+    assert all(len(batch) <= 3 for batch in batches)
+    assert all(sum(len(text) for text in batch) <= 60 for batch in batches)
+
+    translator = StubTranslator()
+    stats = translate_tree(
+        make_tree(texts), "de", translator, max_batch_chars=60, max_batch_size=3
+    )
+    assert stats.batches == translator.batches == len(batches)
+
+
+def test_pool_steps_match_translate_ssml():
+    markup = make_tree().to_markup_string()
+    expected, _ = translate_ssml(markup, "de", StubTranslator())
+
+    texts = ssml_texts(markup)
+    translations = {text: f"[de] {text}" for text in texts}
+    assert texts == TEXTS
+    assert apply_translations(markup, translations, "de") == expected
@@ -0,0 +1,110 @@
+import asyncio
+import re
+
+from lib.parser import S, SSMLTree, Prosody, Text
+from lib.tts_planner import TokenBucket, plan_requests, share_duration
+
+
+WORDS = " ".join(f"word{i:03d}" for i in range(300))
+
+
+def prosody_tree(duration="9000ms", text=WORDS):
+    tree = SSMLTree()
+    tree.add_child(S()).add_child(Prosody(duration=duration)).add_child(Text(text))
+    return tree
+
+
+def durations(requests):
+    return [
+        int(duration)
+        for request in requests
+        for duration in re.findall(r'duration="(\d+)ms"', request.ssml)
+    ]
+
+
+def spoken_text(requests):
+    return "".join(re.sub(r"<[^>]*>", "", request.ssml) for request in requests)
+
+
+def test_split_prosody_shares_its_duration():
+    requests = plan_requests(prosody_tree(), max_bytes=1000)
+
+    assert len(requests) == 3
+    assert sum(durations(requests)) == 9000
+    for request, share in zip(requests, durations(requests)):
+        text = re.sub(r"<[^>]*>", "", request.ssml)
+        assert abs(share - 9000 * len(text) / len(WORDS)) <= 1
+    assert all(request.bytes <= 1000 for request in requests)
+    assert spoken_text(requests) == WORDS
+
+
+def test_durations_in_seconds_are_shared_in_milliseconds():
+    requests = plan_requests(prosody_tree("9s"), max_bytes=1000)
+
+    assert sum(durations(requests)) == 9000
+    assert all(request.bytes <= 1000 for request in requests)
+
+
+def test_request_sizes_match_the_markup():
+    requests = plan_requests(prosody_tree(), max_bytes=700, max_characters=600)
+
+    for request in requests:
+        assert request.characters == len(request.ssml) <= 600
+        assert request.bytes == len(request.ssml.encode()) <= 700
+
+
+def test_shares_add_up_to_the_duration():
+    assert share_duration(9000, [1, 1, 1]) == [3000, 3000, 3000]
+    assert share_duration(1000, [1, 2]) == [333, 667]
+    assert sum(share_duration(1001, [7, 5, 3, 1])) == 1001
+    assert share_duration(10, [0, 0]) == [5, 5]
+
+
+class FakeClock(object):
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_delays_requests_over_the_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, capacity=20, clock=clock)
+
+    assert bucket.reserve(15) == 0.0
+    assert bucket.reserve(10) == 0.5
+    clock.now += 0.5
+    assert bucket.reserve(5) == 0.5
+    clock.now += 100
+    # refills up to the capacity only
+    assert bucket.reserve(20) == 0.0
+    assert bucket.reserve(1) == 0.1
+
+
+def test_token_bucket_goes_into_debt_for_large_requests():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, capacity=20, clock=clock)
+
+    assert bucket.reserve(50) == 3.0
+    # later callers wait behind the debt
+    assert bucket.reserve(10) == 4.0
+    clock.now += 4.0
+    assert bucket.reserve(0) == 0.0
+
+
+def test_token_bucket_per_minute():
+    clock = FakeClock()
+    bucket = TokenBucket.per_minute(6000, clock=clock)
+
+    assert bucket.rate == 100
+    assert bucket.capacity == 100
+    assert bucket.reserve(100) == 0.0
+    assert bucket.reserve(300) == 3.0
+
+
+def test_token_bucket_acquire_async_waits_the_delay():
+    bucket = TokenBucket(rate=1000, capacity=1)
+
+    assert asyncio.run(bucket.acquire_async(1)) == 0.0
+    assert asyncio.run(bucket.acquire_async(11)) > 0.0
@@ -10,3 +10,5 @@ INLINE_TAG_PATTERN = r'(\<([{0}]+)\s*([^/>]*)/>)'.format('|'.join(ACCEPTABLE_INL
 TAG_PATTERN =  r'\<([{0}]+)\s*([^/>]*)>'.format('|'.join(ACCEPTABLE_TAGS))
 
 CLOSE_TAG_PATTERN =  r'\<\/([{0}]+)\s*>'.format('|'.join(ACCEPTABLE_TAGS))
+
+MARKUP_TOKEN_PATTERN = r'<(/?)([\w:-]+)\s*([^>]*?)\s*(/?)>'
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+import gc
 
 def get_attribute_dict(attrib: str):
     return {
@@ -16,4 +18,36 @@ def format_vtt_timestamp_to_ms(timestamp:str) -> int:
     m *= 60000
     s *= 1000
     return h + m + s + ms
-    
\ No newline at end of file
+
+
+def format_ms_to_vtt_timestamp(ms: int) -> str:
+    h, ms = divmod(int(ms), 3600000)
+    m, ms = divmod(ms, 60000)
+    s, ms = divmod(ms, 1000)
+    return f'{h:02d}:{m:02d}:{s:02d}.{ms:03d}'
+
+
+def parse_duration_to_ms(duration) -> int:
+    if duration is None:
+        return None
+    duration = str(duration).strip()
+    try:
+        if duration.endswith('ms'):
+            return int(float(duration[:-2]))
+        if duration.endswith('s'):
+            return int(float(duration[:-1]) * 1000)
+        return int(float(duration))
+    except ValueError:
+        return None
+
+
+@contextmanager
+def paused_gc():
+    """Pauses the cyclic garbage collector while building large trees."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
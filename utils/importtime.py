@@ -0,0 +1,119 @@
+"""Reports the import time of the project modules.
+
+    python -m utils.importtime lib.parser lib.transpiler
+    python -m utils.importtime --stdlib-only lib.parser lib.transpiler
+
+Each module is imported in a fresh interpreter with `-X importtime`.
+With `--stdlib-only` the command fails when a module pulls in anything
+outside the standard library and this project, which keeps parser-only
+workers cheap to start.
+"""
+import argparse
+import subprocess
+import sys
+
+
+PROJECT_PACKAGES = {"lib", "utils"}
+
+DEFAULT_MODULES = [
+    "lib.parser",
+    "lib.arena",
+    "lib.transpiler",
+    "lib.backends",
+    "lib.text_to_speech",
+    "lib.youtube_data",
+]
+
+STDLIB_ONLY_MODULES = [
+    "lib.parser",
+    "lib.arena",
+    "lib.transpiler",
+    "lib.backends",
+    "lib.tts_planner",
+    "lib.text_to_speech",
+]
+
+
+def run_importtime(code: str):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise ImportError(f"running {code!r} failed:\n{result.stderr}")
+    records = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        records.append((name.strip(), int(self_us), int(cumulative_us)))
+    return records
+
+
+def measure_import(module: str, startup_modules=()):
+    """Imports `module` in a new interpreter and returns its import records.
+
+    Each record is `(name, self_us, cumulative_us)`; the last record is the
+    module itself. Modules loaded by the bare interpreter are left out.
+    """
+    records = run_importtime(f"import {module}")
+    return [record for record in records if record[0] not in startup_modules]
+
+
+def third_party_modules(records):
+    return sorted(
+        {
+            name.split(".")[0]
+            for name, _, _ in records
+            if name.split(".")[0] not in sys.stdlib_module_names
+            and name.split(".")[0] not in PROJECT_PACKAGES
+        }
+    )
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("modules", nargs="*", help="modules to import")
+    arg_parser.add_argument(
+        "--top", type=int, default=5, help="slowest imports to list per module"
+    )
+    arg_parser.add_argument(
+        "--stdlib-only",
+        action="store_true",
+        help="fail if a module imports packages outside the standard library",
+    )
+    args = arg_parser.parse_args(argv)
+    modules = args.modules or (
+        STDLIB_ONLY_MODULES if args.stdlib_only else DEFAULT_MODULES
+    )
+
+    startup_modules = {name for name, _, _ in run_importtime("pass")}
+    failed = []
+    for module in modules:
+        try:
+            records = measure_import(module, startup_modules)
+        except ImportError as ex:
+            print(ex)
+            failed.append(module)
+            continue
+        total_us = records[-1][2] if records else 0
+        third_party = third_party_modules(records)
+        print(f"{module}: {total_us / 1000:.1f}ms, {len(records)} modules imported")
+        for name, _, cumulative_us in sorted(
+            records[:-1], key=lambda record: record[2], reverse=True
+        )[: args.top]:
+            print(f"    {name}: {cumulative_us / 1000:.1f}ms")
+        if third_party:
+            print(f"    third party: {', '.join(third_party)}")
+            if args.stdlib_only:
+                failed.append(module)
+
+    if failed:
+        print(f"failed: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())